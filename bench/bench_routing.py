@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# EXCLUDE_FROM_DIST
+
+""" Benchmark of the requests dispatch, comparing the flat rules list Tornado would scan
+with the services indexed dispatch used by the AppServer.
+
+For each configuration, the time needed to find the handler of a request addressed
+to the last route of the last service, and of a request for an unknown path, is measured.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import argparse
+import timeit
+
+import tornado.web
+import tornado.httputil
+
+from pycstbox.webservices.wsapp import AppServer, ServiceDescriptor, WSHandler
+
+
+class DummyHandler(WSHandler):
+    pass
+
+
+def build_services(url_base, count, routes):
+    return [
+        ServiceDescriptor(
+            'svc%03d' % i, 'service %d' % i,
+            [('%ssvc%03d/route%03d/(\\d+)' % (url_base, i, j), DummyHandler) for j in range(routes)]
+        )
+        for i in range(count)
+    ]
+
+
+def measure(app, path, number):
+    request = tornado.httputil.HTTPServerRequest(method='GET', uri=path)
+    return 1e6 * min(timeit.repeat(lambda: app.find_handler(request), number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--routes', type=int, default=10, help='routes per service (default: 10)')
+    parser.add_argument('--number', type=int, default=2000, help='lookups per measure (default: 2000)')
+    parser.add_argument('services', type=int, nargs='*', default=[1, 10, 50, 100],
+                        help='numbers of services to be tested')
+    args = parser.parse_args()
+
+    server = AppServer()
+    url_base = '/api/'
+
+    print("%8s %8s | %12s %12s | %12s %12s" % (
+        'services', 'routes', 'flat last', 'index last', 'flat 404', 'index 404'))
+    for count in args.services:
+        services = build_services(url_base, count, args.routes)
+
+        flat_app = tornado.web.Application(server._setup_handlers(services))
+        indexed_app = tornado.web.Application(server._setup_dispatch_rules(services))
+        server._services_router.application = indexed_app
+
+        last = '%ssvc%03d/route%03d/42' % (url_base, count - 1, args.routes - 1)
+        unknown = '%sunknown/path' % url_base
+        print("%8d %8d | %10.2fus %10.2fus | %10.2fus %10.2fus" % (
+            count, count * args.routes,
+            measure(flat_app, last, args.number), measure(indexed_app, last, args.number),
+            measure(flat_app, unknown, args.number), measure(indexed_app, unknown, args.number)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# EXCLUDE_FROM_DIST
+
+""" Load test of the whole web services stack.
+
+An AppServer is started on a synthetic services home, made of a configurable number of
+services, each one having a configurable number of routes. Their handlers return a JSON
+payload of configurable size, either immediately (sync), after an asynchronous wait
+(async) or after a blocking one run in the executor pool (blocking). The built-in `_diags`
+service is included, its `/hello` and `/routes` requests being used as the baseline.
+
+Each scenario is run by a pool of client threads using persistent connections, each one
+sending its requests in sequence. The throughput, the latency percentiles and the
+resident memory of the server at the end of the scenario are reported. Results can be
+saved as JSON, together with the run parameters, for comparing versions.
+
+The server runs in a child process, so that the load generation does not compete with it
+for the interpreter lock.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import argparse
+import httplib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+import tornado
+
+from pycstbox import log
+import pycstbox.webservices.services
+from pycstbox.webservices.wsapp import AppServer
+
+KINDS = ('sync', 'async', 'blocking')
+
+SERVICE_MODULE = """
+import time
+from tornado import gen
+from pycstbox.webservices.wsapp import WSHandler
+from pycstbox.webservices.executor import blocking
+
+PAYLOAD = {'data': 'x' * %(payload)d}
+LATENCY = %(latency)r
+
+
+class SyncHandler(WSHandler):
+    def do_get(self, *args, **kwargs):
+        self.write(PAYLOAD)
+
+
+class AsyncHandler(WSHandler):
+    @gen.coroutine
+    def do_get(self, *args, **kwargs):
+        yield gen.sleep(LATENCY)
+        self.write(PAYLOAD)
+
+
+class BlockingHandler(WSHandler):
+    @blocking
+    def do_get(self, *args, **kwargs):
+        time.sleep(LATENCY)
+        self.write(PAYLOAD)
+
+
+_kinds = {'sync': SyncHandler, 'async': AsyncHandler, 'blocking': BlockingHandler}
+
+handlers = [
+    ('/%%s%%03d' %% (kind, i), _kinds[kind]) for i, kind in %(routes)r
+]
+"""
+
+SERVICE_MANIFEST = """[service]
+label=Benchmark service %(name)s
+
+[settings]
+executor_slots=%(slots)d
+"""
+
+
+def service_routes(routes):
+    """ Returns the (index, kind) list of the routes of a synthetic service."""
+    return [(i, KINDS[i % len(KINDS)]) for i in range(routes)]
+
+
+def build_services_home(path, services, routes, payload, latency, slots):
+    for i in range(services):
+        name = 'bench%03d' % i
+        service_dir = os.path.join(path, name)
+        os.mkdir(service_dir)
+        with open(os.path.join(service_dir, '__init__.py'), 'w') as fp:
+            fp.write(SERVICE_MODULE % {'payload': payload, 'latency': latency, 'routes': service_routes(routes)})
+        with open(os.path.join(service_dir, 'MANIFEST'), 'w') as fp:
+            fp.write(SERVICE_MANIFEST % {'name': name, 'slots': slots})
+
+    builtin_home = pycstbox.webservices.services.__path__[0]
+    os.symlink(os.path.join(builtin_home, '_diags'), os.path.join(path, '_diags'))
+
+
+def run_server(home, port, options, verbose):
+    pycstbox.webservices.services.__path__.append(home)
+    server = AppServer(port=port, **options)
+    server._logger.setLevel(log.INFO if verbose else log.WARNING)     #pylint: disable=W0212
+    server.services_home = home
+    server.start({})
+
+
+def wait_server(port, process, timeout=60):
+    limit = time.time() + timeout
+    while time.time() < limit:
+        if not process.is_alive():
+            raise RuntimeError('server process terminated')
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError('server not started after %ds' % timeout)
+
+
+def rss_kb(pid):
+    """ Returns the resident memory of a process (and of its children in multi-process mode), in kB."""
+    pids = [pid]
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as fp:
+            pids.extend(int(p) for p in fp.read().split())
+    except IOError:
+        pass
+
+    total = 0
+    for p in pids:
+        with open('/proc/%d/status' % p) as fp:
+            for line in fp:
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1])
+    return total
+
+
+def run_client(port, path, count, latencies, errors):
+    conn = httplib.HTTPConnection('127.0.0.1', port)
+    for _ in range(count):
+        start = time.time()
+        try:
+            conn.request('GET', path)
+            reply = conn.getresponse()
+            reply.read()
+        except (httplib.HTTPException, socket.error):
+            errors.append(path)
+            conn.close()
+            conn = httplib.HTTPConnection('127.0.0.1', port)
+            continue
+        latencies.append(time.time() - start)
+        if reply.status != 200:
+            errors.append(reply.status)
+    conn.close()
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.))]
+
+
+def run_scenario(port, path, requests, concurrency):
+    latencies, errors = [], []
+    per_client = max(1, requests // concurrency)
+    threads = [
+        threading.Thread(target=run_client, args=(port, path, per_client, latencies, errors))
+        for _ in range(concurrency)
+    ]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    result = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput': len(latencies) / elapsed,
+    }
+    if latencies:
+        for p in (50, 90, 99):
+            result['p%d' % p] = 1000. * percentile(latencies, p)
+        result['max'] = 1000. * latencies[-1]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--services', type=int, default=10, help='number of synthetic services (default: 10)')
+    parser.add_argument('--routes', type=int, default=9, help='routes per service (default: 9)')
+    parser.add_argument('--payload', type=int, default=1024, help='payload size, in bytes (default: 1024)')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='latency of async and blocking handlers, in seconds (default: 0.005)')
+    parser.add_argument('--slots', type=int, default=4,
+                        help='executor slots of the synthetic services (default: 4)')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario (default: 2000)')
+    parser.add_argument('--concurrency', type=int, default=10, help='number of clients (default: 10)')
+    parser.add_argument('--processes', type=int, default=1, help='server worker processes (default: 1)')
+    parser.add_argument('--port', type=int, default=18080, help='server port (default: 18080)')
+    parser.add_argument('--json', dest='json_path', help='path of the JSON file the results are saved to')
+    parser.add_argument('--verbose', action='store_true', help='keep the server log')
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix='wsbench-')
+    server = None
+    try:
+        build_services_home(home, args.services, args.routes, args.payload, args.latency, args.slots)
+
+        server = multiprocessing.Process(
+            target=run_server, args=(home, args.port, {'processes': args.processes}, args.verbose)
+        )
+        server.start()
+        wait_server(args.port, server)
+
+        last_service = 'bench%03d' % (args.services - 1)
+        scenarios = [('hello', '/api/_diags/hello'), ('routes', '/api/_diags/routes')]
+        for kind in KINDS:
+            routes = [i for i, k in service_routes(args.routes) if k == kind]
+            if routes and args.services:
+                scenarios.append((kind, '/api/%s/%s%03d' % (last_service, kind, routes[-1])))
+
+        # warm up (imports, lazy initializations,...)
+        for _, path in scenarios:
+            run_scenario(args.port, path, args.concurrency, args.concurrency)
+
+        print("%-10s %8s %7s %10s %9s %9s %9s %9s %10s" % (
+            'scenario', 'requests', 'errors', 'req/s', 'p50', 'p90', 'p99', 'max', 'RSS'))
+        results = []
+        for name, path in scenarios:
+            result = run_scenario(args.port, path, args.requests, args.concurrency)
+            result['scenario'] = name
+            result['path'] = path
+            result['rss_kb'] = rss_kb(server.pid)
+            results.append(result)
+            print("%-10s %8d %7d %10.1f %7.2fms %7.2fms %7.2fms %7.2fms %8dkB" % (
+                name, result['requests'], result['errors'], result['throughput'],
+                result.get('p50', 0), result.get('p90', 0), result.get('p99', 0), result.get('max', 0),
+                result['rss_kb']
+            ))
+
+        if args.json_path:
+            with open(args.json_path, 'w') as fp:
+                json.dump({
+                    'parameters': dict((k, v) for k, v in vars(args).items() if k not in ('json_path', 'verbose')),
+                    'python': platform.python_version(),
+                    'tornado': tornado.version,
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'results': results
+                }, fp, indent=2, sort_keys=True)
+
+    finally:
+        if server and server.is_alive():
+            os.kill(server.pid, signal.SIGTERM)
+            server.join(10)
+        shutil.rmtree(home, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -27,20 +27,48 @@
 
 __author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
 
-import os.path
+import os
 import sys
 
 from pycstbox import cli, log
 from pycstbox.webservices.wsapp import AppServer
+from pycstbox.webservices.profiling import PROFILE_TOKEN_ENV
 
 _here = os.path.dirname(__file__)
 
 
 if __name__ == '__main__':
     parser = cli.get_argument_parser('CSTBox Web based console service')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of worker processes (0 for one per CPU, default: 1)')
+    parser.add_argument('--lazy', action='store_true',
+                        help='load services on their first request when their manifest allows it')
+    parser.add_argument('--compress', action='store_true',
+                        help='compress the replies when the client accepts it')
+    parser.add_argument('--rate-limit', type=float,
+                        help='number of requests per second allowed for each client (default: no limit)')
+    parser.add_argument('--max-in-flight', type=int,
+                        help='maximum number of requests processed at the same time (default: no limit)')
+    parser.add_argument('--log-sampling', type=int, default=1,
+                        help='log only one out of this number of successful requests per route (default: 1)')
+    parser.add_argument('--drain-timeout', type=float, default=10.,
+                        help='time given to the requests in progress to complete on stop, in seconds (default: 10)')
+    parser.add_argument('--loop-lag-threshold', type=float, default=0.1,
+                        help='time the server loop can be blocked before being reported, in seconds '
+                             '(0 to disable the monitoring, default: 0.1)')
+    parser.add_argument('--profile-token-file',
+                        help='file containing the token authorizing the profiling of requests (default: token '
+                             'read from the %s environment variable, profiling disabled if not set)'
+                             % PROFILE_TOKEN_ENV)
+    parser.add_argument('--pidfile',
+                        help='file in which the pid of the server process is written, updated when the '
+                             'server is restarted on SIGHUP (default: none)')
     args = parser.parse_args()
 
-    server = AppServer(debug=args.debug)
+    server = AppServer(debug=args.debug, processes=args.processes, lazy=args.lazy, compression=args.compress,
+                       rate_limit=args.rate_limit, max_in_flight=args.max_in_flight,
+                       access_log_sampling=args.log_sampling, drain_timeout=args.drain_timeout,
+                       loop_lag_threshold=args.loop_lag_threshold, pid_file=args.pidfile)
     server._logger.setLevel(log.loglevel_from_args(args))
 
     # Configure the weblets home dir for this app. Default setting points to
@@ -50,6 +78,14 @@ if __name__ == '__main__':
 
     settings = {
     }
+    # the token is not accepted on the command line, where it would be visible to all the users
+    if args.profile_token_file:
+        with open(args.profile_token_file) as fp:
+            profile_token = fp.read().strip()
+    else:
+        profile_token = os.environ.get(PROFILE_TOKEN_ENV)
+    if profile_token:
+        settings['profile_token'] = profile_token
 
     try:
         server.toplevel_handlers.extend([
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Asynchronous writing of the requests log.
+
+Emitting a log record involves formatting and I/O (file, syslog,...) which can take
+a significant time on small boxes with flash storage. To keep them out of the requests
+processing, access log records are posted to a bounded queue, from which a background
+thread takes them by batches and emits them. The records are never waited for : if the
+queue is full, they are dropped and counted, and the number of lost records is logged
+when the queue becomes available again.
+
+Successful requests of high volume routes can be sampled, only one out of a given
+number of them being logged for each route.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import Queue
+import threading
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 100
+
+# marker used to stop the writer thread
+_STOP = object()
+
+
+class AccessLogWriter(object):
+    """ Emits log records in a background thread.
+    """
+    def __init__(self, logger, sampling=1, queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :Parameters:
+            logger : logging.Logger
+                the logger the records are emitted to
+            sampling : int
+                only one out of this number of successful (2xx) requests is logged for a
+                given route (default: 1, i.e. all requests are logged)
+            queue_size : int
+                the maximum number of records waiting for being emitted
+            batch_size : int
+                the maximum number of records emitted at once
+        """
+        self._logger = logger
+        self.sampling = max(1, sampling)
+        self._queue = Queue.Queue(maxsize=queue_size)
+        self._batch_size = batch_size
+        self._route_counts = {}
+        self._dropped = 0
+        self._thread = None
+
+    def start(self):
+        """ Starts the writer thread.
+
+        In multi-process mode, this must be done in the workers, after the fork.
+        """
+        self._thread = threading.Thread(target=self._run, name='access-log')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """ Stops the writer thread, once the pending records are emitted."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except Queue.Full:
+            return
+        self._thread.join(timeout)
+        self._thread = None
+
+    def sampled_out(self, route, status):
+        """ Tells if the record of a request can be skipped because of the sampling."""
+        if self.sampling == 1 or not 200 <= status < 300:
+            return False
+        count = self._route_counts.get(route, 0)
+        self._route_counts[route] = count + 1
+        return count % self.sampling != 0
+
+    def log(self, level, msg, *args):
+        """ Posts a record, the message being formatted by the writer thread."""
+        try:
+            self._queue.put_nowait((level, msg, args))
+        except Queue.Full:
+            self._dropped += 1
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            batch = [queue.get()]
+            try:
+                while len(batch) < self._batch_size:
+                    batch.append(queue.get_nowait())
+            except Queue.Empty:
+                pass
+
+            for record in batch:
+                if record is _STOP:
+                    return
+                level, msg, args = record
+                self._logger.log(level, msg, *args)
+
+            # the counter is updated by the loop thread, but an approximate value is fine here
+            dropped, self._dropped = self._dropped, 0
+            if dropped:
+                self._logger.warning("%d access log records dropped (queue full)", dropped)
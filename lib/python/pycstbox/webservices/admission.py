@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Admission control of the requests.
+
+Two mechanisms protect the server loop against overload :
+    - rate limiting : each client (identified by its IP address) is given a token bucket,
+    refilled at a fixed rate, and a request is rejected with a 429 status if the bucket is
+    empty. The `Retry-After` header of the reply gives the delay after which a token will
+    be available.
+    - concurrency limiting : the number of requests being processed at the same time is
+    capped, and requests exceeding it are rejected immediately with a 503 status, instead
+    of being queued and increasing the latency of all the others.
+
+Both can be configured at server level, applying to all the requests, and at service
+level, applying to the requests addressed to the service. Service level rate limits are
+enforced per client too, each client having a bucket per service.
+
+The classes of this module are not thread safe, and must be used from the server loop
+thread only.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import math
+import time
+from collections import OrderedDict
+
+# MANIFEST settings keys used for configuring the admission control of a service
+SETTING_RATE_LIMIT = 'rate_limit'
+SETTING_RATE_BURST = 'rate_burst'
+SETTING_MAX_IN_FLIGHT = 'max_in_flight'
+
+# maximum number of clients buckets kept by a rate limiter
+DEFAULT_MAX_CLIENTS = 10000
+
+# delay suggested to clients rejected because of the concurrency limit, in seconds
+OVERLOAD_RETRY_AFTER = 1
+
+
+class RateLimiter(object):
+    """ Per-client token buckets.
+
+    The least recently seen clients are forgotten when the number of buckets exceeds
+    the configured limit, which is harmless since they get a full bucket if they come back.
+    """
+    def __init__(self, rate, burst=None, max_clients=DEFAULT_MAX_CLIENTS, clock=time.time):
+        """
+        :Parameters:
+            rate : float
+                the sustained number of requests per second allowed for a client
+            burst : int
+                the maximum number of requests a client can send at once (default: rate,
+                with a minimum of 1)
+            max_clients : int
+                the maximum number of clients buckets kept
+            clock : callable
+                the function returning the current time
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self._max_clients = max_clients
+        self._clock = clock
+        # client -> [tokens, last update time]
+        self._buckets = OrderedDict()
+
+    def check(self, client):
+        """ Tells if a token of the bucket of a client is available, without consuming it.
+
+        :returns: 0 if a token is available, or the delay in seconds after which one
+        will be otherwise
+        """
+        bucket = self._refill(client)
+        if bucket[0] >= 1:
+            return 0
+        return (1 - bucket[0]) / self.rate
+
+    def consume(self, client):
+        """ Consumes a token of the bucket of a client, which availability has been
+        checked by :py:meth:`check` just before.
+        """
+        self._buckets[client][0] -= 1
+
+    def _refill(self, client):
+        """ Returns the bucket of a client, updated with the tokens added since its last use."""
+        now = self._clock()
+        bucket = self._buckets.pop(client, None)
+        if bucket is None:
+            bucket = [self.burst, now]
+            if len(self._buckets) >= self._max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        self._buckets[client] = bucket
+        return bucket
+
+
+class Limits(object):
+    """ The rate and concurrency limits applying to a scope (the whole server or a service),
+    and the number of requests of the scope being processed.
+    """
+    def __init__(self, rate=None, burst=None, max_in_flight=None):
+        """
+        :Parameters:
+            rate : float
+                the number of requests per second allowed for a client (no limit if None)
+            burst : int
+                the maximum number of requests a client can send at once
+            max_in_flight : int
+                the maximum number of requests processed at the same time (no limit if None)
+        """
+        self.rate_limiter = RateLimiter(rate, burst) if rate else None
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.rejected = 0
+        self.shed = 0
+
+
+class AdmissionControl(object):
+    """ Decides if requests can be processed, according to the server and services limits.
+    """
+    def __init__(self, rate=None, burst=None, max_in_flight=None):
+        """ The parameters are the server level limits, with the same meaning as in
+        :py:class:`Limits`.
+        """
+        self._global = Limits(rate, burst, max_in_flight)
+        self._services = {}
+
+    def configure_service(self, service_name, rate=None, burst=None, max_in_flight=None):
+        """ Sets the limits of a service."""
+        self._services[service_name] = Limits(rate, burst, max_in_flight)
+
+    def admit(self, client, service_name):
+        """ Checks if a request can be processed, and accounts for it if so.
+
+        An admitted request must be signaled with :py:meth:`release` when its
+        processing is terminated.
+
+        :Parameters:
+            client : str
+                the client identifier (its IP address)
+            service_name : str
+                the name of the service the request is addressed to (None for server level
+                requests)
+
+        :returns: None if the request is admitted, or a (status, retry after) tuple giving
+        the reply status and the delay to be sent back in the `Retry-After` header otherwise
+        """
+        scopes = [self._global]
+        service_limits = self._services.get(service_name)
+        if service_limits:
+            scopes.append(service_limits)
+
+        # overload shedding goes first, so that rejected requests do not consume tokens
+        for limits in scopes:
+            if limits.max_in_flight and limits.in_flight >= limits.max_in_flight:
+                limits.shed += 1
+                return 503, OVERLOAD_RETRY_AFTER
+
+        # tokens are consumed only once all the scopes accept the request, so that a request
+        # rejected by a service limit does not use the server level budget of its client
+        for limits in scopes:
+            if limits.rate_limiter:
+                delay = limits.rate_limiter.check(client)
+                if delay:
+                    limits.rejected += 1
+                    return 429, int(math.ceil(delay))
+
+        for limits in scopes:
+            if limits.rate_limiter:
+                limits.rate_limiter.consume(client)
+            limits.in_flight += 1
+        return None
+
+    def release(self, service_name):
+        """ Signals the end of the processing of an admitted request."""
+        self._global.in_flight -= 1
+        service_limits = self._services.get(service_name)
+        if service_limits:
+            service_limits.in_flight -= 1
+
+    def stats(self):
+        """ Returns the admission statistics as a dictionary."""
+        def limits_stats(limits):
+            return {
+                'in_flight': limits.in_flight,
+                'rejected': limits.rejected,
+                'shed': limits.shed
+            }
+
+        return {
+            'server': limits_stats(self._global),
+            'services': dict((name, limits_stats(limits)) for name, limits in self._services.items())
+        }
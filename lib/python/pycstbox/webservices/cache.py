@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" In-memory cache of request replies.
+
+Replies are stored with their status, headers and body, under a key made of the
+handler class (the "tag" of the entry) and of the request URI with its normalized
+query arguments. Entries expire after the time-to-live given when storing them, and
+the least recently used ones are evicted when the total size of the stored data
+exceeds the cache capacity.
+
+The cache is not thread safe, and must be used from the server loop thread only. It is
+local to a process, and thus not shared by the workers in multi-process mode.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import time
+from collections import namedtuple, OrderedDict
+
+DEFAULT_MAX_SIZE = 4 * 1024 * 1024
+
+# rough estimation of the memory used by an entry, in addition to its data
+_ENTRY_OVERHEAD = 256
+
+
+class CachedReply(namedtuple('CachedReply', 'status headers body expires size variants')):
+    """ A cached reply.
+
+    Included attributes:
+        - the reply HTTP status
+        - the list of (name, value) tuples of the reply headers
+        - the reply body, as a byte string
+        - the time after which the entry is no more valid
+        - the estimated memory footprint of the entry
+        - a dictionary of alternate forms of the body (compressed ones for instance), keyed
+        by their name
+    """
+
+
+def tag_name(tag):
+    """ Returns the name used for reporting the statistics of a tag."""
+    return '%s.%s' % (tag.__module__, tag.__name__)
+
+
+class ResponseCache(object):
+    """ LRU cache of replies, with time-to-live based expiration and global size limit.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, clock=time.time):
+        """
+        :Parameters:
+            max_size : int
+                the maximum total size of the cached data, in bytes
+            clock : callable
+                the function returning the current time
+        """
+        self.max_size = max_size
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._tag_keys = {}
+        self._size = 0
+        self._counters = {}
+        self._evictions = 0
+
+    def _count(self, tag, hit):
+        counters = self._counters.setdefault(tag, [0, 0])
+        counters[0 if hit else 1] += 1
+
+    def get(self, tag, key):
+        """ Returns the valid entry stored for a given key, or None if none is available.
+        """
+        full_key = (tag, key)
+        entry = self._entries.pop(full_key, None)
+        if entry is None:
+            self._count(tag, False)
+            return None
+
+        if entry.expires <= self._clock():
+            self._forget(full_key, entry)
+            self._count(tag, False)
+            return None
+
+        # re-insert the entry to flag it as the most recently used one
+        self._entries[full_key] = entry
+        self._count(tag, True)
+        return entry
+
+    def put(self, tag, key, status, headers, body, ttl):
+        """ Stores a reply.
+
+        :Parameters:
+            tag : type
+                the handler class which produced the reply
+            key : hashable
+                the request key
+            status : int
+                the reply status
+            headers : list
+                the list of (name, value) tuples of the reply headers
+            body : str
+                the reply body
+            ttl : float
+                the time-to-live of the entry, in seconds
+        """
+        # the previous reply is outdated, even if the new one cannot be stored
+        full_key = (tag, key)
+        previous = self._entries.pop(full_key, None)
+        if previous:
+            self._forget(full_key, previous)
+
+        size = len(body) + sum(len(n) + len(v) for n, v in headers) + _ENTRY_OVERHEAD
+        if size > self.max_size:
+            return
+
+        self._entries[full_key] = CachedReply(status, headers, body, self._clock() + ttl, size, {})
+        self._tag_keys.setdefault(tag, set()).add(full_key)
+        self._size += size
+
+        while self._size > self.max_size:
+            oldest_key = next(iter(self._entries))
+            self._forget(oldest_key, self._entries.pop(oldest_key))
+            self._evictions += 1
+
+    def add_variant(self, tag, key, name, data):
+        """ Stores an alternate form of the body of an entry, if it is still in the cache.
+
+        :Parameters:
+            tag : type
+                the handler class which produced the reply
+            key : hashable
+                the request key
+            name : str
+                the name of the variant (the content encoding for instance)
+            data : str
+                the variant body
+        """
+        full_key = (tag, key)
+        entry = self._entries.get(full_key)
+        if entry is None or name in entry.variants:
+            return
+
+        entry.variants[name] = data
+        self._entries[full_key] = entry._replace(size=entry.size + len(data))
+        self._size += len(data)
+
+        while self._size > self.max_size:
+            oldest_key = next(iter(self._entries))
+            self._forget(oldest_key, self._entries.pop(oldest_key))
+            self._evictions += 1
+
+    def _forget(self, full_key, entry):
+        """ Updates the bookkeeping data after the removal of an entry from the dictionary."""
+        self._size -= entry.size
+        keys = self._tag_keys.get(full_key[0])
+        if keys:
+            keys.discard(full_key)
+
+    def invalidate(self, tag=None, path=None):
+        """ Removes entries from the cache.
+
+        :Parameters:
+            tag : type
+                if provided, only the entries of this handler class are removed
+            path : str
+                if provided, only the entries for this request path are removed.
+                Entries keys are supposed to be tuples starting with the path in this case.
+
+        :returns: the number of removed entries
+        """
+        if tag is None:
+            keys = list(self._entries)
+        else:
+            keys = list(self._tag_keys.get(tag, ()))
+        if path is not None:
+            keys = [k for k in keys if k[1][0] == path]
+
+        for full_key in keys:
+            self._forget(full_key, self._entries.pop(full_key))
+        return len(keys)
+
+    def stats(self):
+        """ Returns the cache statistics as a dictionary."""
+        return {
+            'entries': len(self._entries),
+            'size': self._size,
+            'max_size': self.max_size,
+            'evictions': self._evictions,
+            'tags': dict(
+                (tag_name(tag), {'hits': hits, 'misses': misses})
+                for tag, (hits, misses) in self._counters.items()
+            )
+        }
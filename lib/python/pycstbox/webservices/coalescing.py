@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Coalescing of identical concurrent requests ("single flight").
+
+The first request for a given key starts the computation of the reply, and identical
+requests received while it is in progress wait for it and share its result, instead of
+running the same computation again. Once the reply is produced, the key is released and
+the next request starts a new computation. Contrary to caching, replies are never reused
+after their computation has completed, which makes it suitable for data which must not
+be stale.
+
+The registry is not thread safe, and must be used from the server loop thread only.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+from tornado.concurrent import Future
+
+from pycstbox.webservices.cache import tag_name
+
+
+class SingleFlight(object):
+    """ Registry of the computations in progress.
+    """
+    def __init__(self):
+        self._flights = {}
+        # (computations, coalesced requests) counters, by tag
+        self._counters = {}
+
+    def join(self, tag, key):
+        """ Joins the computation in progress for a key, if any.
+
+        :Parameters:
+            tag : type
+                the handler class processing the request
+            key : hashable
+                the request key
+
+        :returns: the future resolving to the shared reply if a computation is in progress,
+            or None if there is none. In the latter case, the caller is in charge of the
+            computation, and must call :py:meth:`land` when done.
+        """
+        full_key = (tag, key)
+        counters = self._counters.setdefault(tag, [0, 0])
+        future = self._flights.get(full_key)
+        if future is not None:
+            counters[1] += 1
+            return future
+        self._flights[full_key] = Future()
+        counters[0] += 1
+        return None
+
+    def land(self, tag, key, reply):
+        """ Terminates a computation, and passes its reply to the requests waiting for it.
+
+        :Parameters:
+            tag : type
+                the handler class processing the request
+            key : hashable
+                the request key
+            reply : CachedReply
+                the shared reply, or the exception to be raised by the waiting requests,
+                or None if the reply cannot be shared. The waiting requests must then
+                process the request by themselves.
+        """
+        future = self._flights.pop((tag, key), None)
+        if future is not None:
+            future.set_result(reply)
+
+    def stats(self):
+        """ Returns the coalescing statistics as a dictionary."""
+        return {
+            'in_progress': len(self._flights),
+            'tags': dict(
+                (tag_name(tag), {'computations': computations, 'coalesced': coalesced})
+                for tag, (computations, coalesced) in self._counters.items()
+            )
+        }
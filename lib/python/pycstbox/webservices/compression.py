@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Compression of the replies.
+
+Supported encodings are gzip and deflate, plus brotli if the `brotli` package is installed.
+The encoding is selected according to the `Accept-Encoding` header of the request, brotli
+being preferred to gzip, itself preferred to deflate.
+
+Only replies of compressible content types and which size reaches a given threshold are
+compressed. For streamed replies, the size considered is the one of the first chunk.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import zlib
+
+import tornado.web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_LEVEL = 6
+
+ENCODINGS = (('br',) if brotli else ()) + ('gzip', 'deflate')
+
+COMPRESSIBLE_TYPES = frozenset((
+    'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml', 'application/msgpack'
+))
+
+
+def _compressor(encoding, level):
+    """ Returns a streaming compressor for an encoding, as a (compress, flush, finish)
+    functions tuple.
+    """
+    if encoding == 'br':
+        c = brotli.Compressor(quality=level)
+        return c.process, c.flush, c.finish
+
+    # gzip format is obtained by adding 16 to wbits
+    wbits = zlib.MAX_WBITS + (16 if encoding == 'gzip' else 0)
+    c = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+
+class Compression(object):
+    """ The server replies compression configuration.
+    """
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, level=DEFAULT_LEVEL, encodings=ENCODINGS):
+        """
+        :Parameters:
+            min_size : int
+                the minimal size of the replies to be compressed
+            level : int
+                the compression level, from 1 (fastest) to 9 (best compression)
+            encodings : tuple
+                the enabled encodings, in order of preference
+        """
+        self.min_size = min_size
+        self.level = level
+        self.encodings = tuple(e for e in encodings if e in ENCODINGS)
+
+    def negotiate(self, accept_encoding):
+        """ Returns the encoding to be used given the `Accept-Encoding` header of a request,
+        or None if no compression must be applied.
+        """
+        accepted, refused = set(), set()
+        for item in accept_encoding.split(','):
+            parts = item.split(';')
+            quality = 1.
+            for param in parts[1:]:
+                name, _, value = param.partition('=')
+                if name.strip() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.
+            (accepted if quality > 0 else refused).add(parts[0].strip().lower())
+        for encoding in self.encodings:
+            # the wildcard only applies to the encodings not explicitly listed (RFC 7231 5.3.4)
+            if encoding in accepted or ('*' in accepted and encoding not in refused):
+                return encoding
+        return None
+
+    @staticmethod
+    def is_compressible(content_type):
+        content_type = content_type.split(';')[0].strip()
+        return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+    def compress(self, data, encoding):
+        """ Returns compressed data."""
+        compress, _, finish = _compressor(encoding, self.level)
+        return compress(data) + finish()
+
+    def transform(self, request):
+        """ Factory of the output transforms applying the compression to a reply,
+        to be registered in the application transforms list.
+        """
+        return CompressionTransform(self, request)
+
+
+class CompressionTransform(tornado.web.OutputTransform):
+    """ Output transform compressing replies on the fly.
+
+    Replies already having a `Content-Encoding` header (precompressed ones for instance)
+    are left untouched.
+    """
+    def __init__(self, compression, request):    #pylint: disable=W0231
+        self._compression = compression
+        self._encoding = compression.negotiate(request.headers.get('Accept-Encoding', ''))
+        self._compress = self._flush = self._finish = None
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        if 'Vary' in headers:
+            headers['Vary'] += ', Accept-Encoding'
+        else:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if not (self._encoding and
+                len(chunk) >= self._compression.min_size and
+                'Content-Encoding' not in headers and
+                self._compression.is_compressible(headers.get('Content-Type', ''))):
+            self._encoding = None
+            return status_code, headers, chunk
+
+        headers['Content-Encoding'] = self._encoding
+        self._compress, self._flush, self._finish = _compressor(self._encoding, self._compression.level)
+        chunk = self.transform_chunk(chunk, finishing)
+        if 'Content-Length' in headers:
+            if finishing:
+                headers['Content-Length'] = str(len(chunk))
+            else:
+                del headers['Content-Length']
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if self._encoding:
+            chunk = self._compress(chunk) + (self._finish() if finishing else self._flush())
+        return chunk
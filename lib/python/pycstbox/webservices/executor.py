@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Support for running blocking request handlers outside of the server loop.
+
+Services which need to call blocking code (hardware access, D-Bus calls,...) can
+mark the involved `do_xxx` methods with the :py:func:`blocking` decorator. If the service
+has opted in the executor mode in its MANIFEST, these methods are then run in a
+thread pool shared by all the services, instead of blocking the server loop.
+
+Each service is given its own :py:class:`ServiceExecutor`, which limits the number of
+its calls running concurrently in the shared pool, and the number of calls waiting for
+a free slot. This way, a service stuck on a slow device cannot exhaust the whole pool.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import collections
+from functools import partial
+
+import tornado.ioloop
+from tornado.concurrent import Future, chain_future
+
+# MANIFEST settings keys used for configuring the executor mode of a service
+SETTING_EXECUTOR_SLOTS = 'executor_slots'
+SETTING_EXECUTOR_QUEUE = 'executor_queue'
+
+DEFAULT_QUEUE_SIZE = 16
+
+
+def blocking(method):
+    """ Decorator marking a `do_xxx` request handler method as blocking.
+
+    If the service owning the handler has the executor mode enabled, the method
+    is run in the shared thread pool. Otherwise it is run in the server loop, as
+    any other method.
+
+    Since the method is executed in a foreign thread, it must limit itself to
+    building the reply (`set_status`, `set_header`, `write`,...) and must not
+    call `flush` or `finish`, which are taken care of by the framework.
+    """
+    method.blocking = True
+    return method
+
+
+class ServiceBusy(Exception):
+    """ Raised when a call is submitted while the service waiting queue is full."""
+
+
+class ServiceExecutor(object):
+    """ Per-service gate to the shared thread pool.
+
+    Instances are not thread safe, and must be used from the server loop thread only.
+    """
+    def __init__(self, pool, slots, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        :Parameters:
+            pool : concurrent.futures.Executor
+                the shared pool
+            slots : int
+                the maximum count of calls running concurrently in the pool for the service
+            queue_size : int
+                the maximum count of calls waiting for a free slot
+        """
+        if slots < 1:
+            raise ValueError('slots must be a positive number')
+        self._pool = pool
+        self._slots = slots
+        self._queue_size = queue_size
+        self._running = 0
+        self._waiting = collections.deque()
+
+    @property
+    def slots(self):
+        return self._slots
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def waiting(self):
+        return len(self._waiting)
+
+    def submit(self, fn, *args, **kwargs):
+        """ Schedules the execution of a call.
+
+        :returns: a future resolved with the result of the call
+        :raises ServiceBusy: if all slots are used and the waiting queue is full
+        """
+        if self._running >= self._slots and len(self._waiting) >= self._queue_size:
+            raise ServiceBusy()
+
+        future = Future()
+        self._waiting.append((future, fn, args, kwargs))
+        self._schedule()
+        return future
+
+    def _schedule(self):
+        ioloop = tornado.ioloop.IOLoop.current()
+        while self._waiting and self._running < self._slots:
+            future, fn, args, kwargs = self._waiting.popleft()
+            self._running += 1
+            pool_future = self._pool.submit(fn, *args, **kwargs)
+            # the result is passed from the loop thread, since our futures are not thread safe
+            ioloop.add_future(pool_future, partial(self._release, future))
+
+    def _release(self, future, pool_future):
+        self._running -= 1
+        chain_future(pool_future, future)
+        self._schedule()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Formats of the replies, negotiated with the clients through the `Accept` header.
+
+Supported formats are :
+    - JSON (`application/json`), which is the default one
+    - MessagePack (`application/msgpack`, `application/x-msgpack` being accepted too),
+    if the `msgpack` package is installed
+    - a binary columnar layout (`application/vnd.cstbox.columns`), available for replies
+    made of columns of numbers only, such as time series
+
+The columnar layout lets clients map the columns directly to typed arrays (`Float64Array`
+in browsers, NumPy arrays,...), and is built by the server from the buffers of `array.array`
+or NumPy arrays, without creating a Python object per value. It is made of (little endian) :
+    - a header : magic (4 bytes), version (uint8), reserved (1 byte), columns count (uint16)
+    - the columns descriptors : type (2 ASCII characters, the kind among `f` (float),
+    `i` (signed integer) and `u` (unsigned integer) followed by the size in bytes, e.g. `f8`),
+    values count (uint32), name length (uint16), name (UTF-8)
+    - the columns values, in the descriptors order, each column starting at an offset
+    multiple of 8 bytes from the start of the reply
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import array
+import struct
+import sys
+from collections import OrderedDict
+
+from pycstbox.webservices.jsonenc import _default
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+COLUMNS = 'application/vnd.cstbox.columns'
+
+# media types recognized as synonyms of the supported ones
+_ALIASES = {
+    'application/x-msgpack': MSGPACK,
+}
+
+# formats available for replies of any kind, and for columns replies, in order of preference
+DOCUMENT_FORMATS = (JSON,) + ((MSGPACK,) if msgpack else ())
+COLUMNS_FORMATS = DOCUMENT_FORMATS + (COLUMNS,)
+
+COLUMNS_MAGIC = 'WSCB'
+COLUMNS_VERSION = 1
+
+_COLUMNS_HEADER = struct.Struct('<4sBxH')
+_COLUMN_DESCRIPTOR = struct.Struct('<2sIH')
+_ALIGNMENT = 8
+
+# array.array type codes, by kind
+_ARRAY_KINDS = dict([(c, 'f') for c in 'fd'] + [(c, 'i') for c in 'bhil'] + [(c, 'u') for c in 'BHIL'])
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+# results of the negotiations, by (Accept header, offered formats)
+_negotiated = {}
+_NEGOTIATED_MAX_SIZE = 256
+
+
+def _parse_accept(accept):
+    """ Returns the (media range, quality) pairs of an `Accept` header."""
+    ranges = []
+    for item in accept.split(','):
+        parts = item.split(';')
+        media_range = parts[0].strip().lower()
+        quality = 1.
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.
+        ranges.append((_ALIASES.get(media_range, media_range), quality))
+    return ranges
+
+
+def _select(accept, offered):
+    ranges = _parse_accept(accept)
+    best, best_score = None, None
+    for rank, media_type in enumerate(offered):
+        main_type = media_type.split('/')[0] + '/*'
+        # the quality of a type is the one of the most specific range matching it
+        specificity, quality = max(
+            [(2, q) for r, q in ranges if r == media_type] +
+            [(1, q) for r, q in ranges if r == main_type] +
+            [(0, q) for r, q in ranges if r == '*/*'] or [(0, 0.)]
+        )
+        if quality <= 0:
+            continue
+        # explicitly requested types win over wildcard matches with the same quality
+        score = (quality, specificity, -rank)
+        if best_score is None or score > best_score:
+            best, best_score = media_type, score
+    # the default format is used if none is acceptable, rather than replying with a 406 status
+    return best or offered[0]
+
+
+def negotiate(accept, offered):
+    """ Returns the reply format to be used, given the `Accept` header of a request.
+
+    :Parameters:
+        accept : str
+            the `Accept` header of the request (can be empty)
+        offered : tuple
+            the formats available for the reply, in order of preference. The first one
+            is the default, used if the request does not accept any of them.
+    """
+    if not accept:
+        return offered[0]
+    key = (accept, offered)
+    result = _negotiated.get(key)
+    if result is None:
+        if len(_negotiated) >= _NEGOTIATED_MAX_SIZE:
+            _negotiated.clear()
+        result = _negotiated[key] = _select(accept, offered)
+    return result
+
+
+def encode_msgpack(data):
+    """ Returns the MessagePack representation of the data.
+
+    Types not natively supported are encoded as in JSON replies.
+    """
+    # str are packed as raw strings, as done by Python 2 clients
+    return msgpack.packb(data, default=_default, use_bin_type=False)
+
+
+def _column_data(values):
+    """ Returns the type, the values count and the little endian bytes of a column."""
+    if not isinstance(values, array.array):
+        dtype = getattr(values, 'dtype', None)
+        if dtype is not None:
+            # NumPy array
+            if dtype.kind not in 'fiu' or values.ndim != 1:
+                raise TypeError('unsupported column type : %s' % dtype)
+            type_code = '%s%d' % (dtype.kind, dtype.itemsize)
+            return type_code, len(values), values.astype('<' + type_code, copy=False).tobytes()
+        values = array.array('d', values)
+
+    kind = _ARRAY_KINDS.get(values.typecode)
+    if kind is None:
+        raise TypeError('unsupported column type : %s' % values.typecode)
+    if _BIG_ENDIAN:
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return '%s%d' % (kind, values.itemsize), len(values), values.tostring()
+
+
+def encode_columns(columns):
+    """ Returns the columnar representation of columns of numbers.
+
+    :Parameters:
+        columns : list
+            the (name, values) pairs of the columns, the values being `array.array`
+            or 1-D NumPy arrays. Other sequences are converted to arrays of doubles.
+    """
+    descriptors = []
+    blocks = []
+    for name, values in columns:
+        type_code, count, data = _column_data(values)
+        name = name.encode('utf-8')
+        descriptors.append(_COLUMN_DESCRIPTOR.pack(type_code, count, len(name)) + name)
+        blocks.append(data)
+
+    parts = [_COLUMNS_HEADER.pack(COLUMNS_MAGIC, COLUMNS_VERSION, len(descriptors))]
+    parts.extend(descriptors)
+    offset = sum(len(p) for p in parts)
+    for data in blocks:
+        padding = -offset % _ALIGNMENT
+        if padding:
+            parts.append('\0' * padding)
+        parts.append(data)
+        offset += padding + len(data)
+    return b''.join(parts)
+
+
+def columns_as_dict(columns):
+    """ Returns columns as a dictionary of lists, for the formats other than the columnar one."""
+    return OrderedDict(
+        (name, values.tolist() if hasattr(values, 'tolist') else list(values)) for name, values in columns
+    )
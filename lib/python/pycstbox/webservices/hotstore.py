@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Shared memory store of the latest values of variables.
+
+The store is a memory-mapped file, containing a fixed number of slots. Each slot holds the
+name of a variable, its latest value and the time of this value. It is written by the
+processes producing the values (collectors for instance), and read by the web services
+processes without any system call, lock or inter-process communication.
+
+Consistency between a writer and the readers of a slot is ensured by a sequence counter
+(seqlock) : the writer increments it before and after updating the slot, so that it is
+odd while an update is in progress. Readers read the counter before and after reading
+the slot, and retry if it was odd or has changed. A given variable must be written by a
+single process at a time. Slots allocation is protected by an exclusive lock of the file,
+which is only taken by writers when they meet a new variable.
+
+File layout (little endian) :
+    - header : magic (4 bytes), version (uint32), capacity (uint32), used slots count (uint32)
+    - slots : sequence counter (uint32), padding (4 bytes), name (48 bytes, UTF-8, NUL padded),
+    value (double), timestamp (double)
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+MAGIC = 'WSHS'
+VERSION = 1
+
+DEFAULT_CAPACITY = 4096
+
+_HEADER = struct.Struct('<4sIII')
+_SEQ = struct.Struct('<I')
+_NAME = struct.Struct('<48s')
+_DATA = struct.Struct('<dd')
+_SLOT_SIZE = _SEQ.size + 4 + _NAME.size + _DATA.size
+# the slot fields used for bulk reads (the name is skipped)
+_SLOT_FORMAT = 'I52xdd'
+_SLOT_SEQ_FORMAT = 'I68x'
+# used for detecting odd sequences from their low byte
+_EVEN_BYTES = ''.join(chr(i) for i in range(0, 256, 2))
+_NAME_OFFSET = 8
+_DATA_OFFSET = _NAME_OFFSET + _NAME.size
+_USED_OFFSET = 12
+
+MAX_NAME_LENGTH = _NAME.size
+
+# number of attempts to get a consistent read of a slot being written
+_MAX_READ_ATTEMPTS = 1000
+
+
+class HotStoreError(Exception):
+    pass
+
+
+class HotStore(object):
+    """ A shared memory store of variables latest values.
+    """
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, create=False):
+        """
+        :Parameters:
+            path : str
+                the path of the store file
+            capacity : int
+                the number of slots, used when creating the file
+            create : bool
+                if True, the file is created if it does not exist
+        :raises HotStoreError: if the file is not a valid store
+        """
+        self.path = path
+        if create and not os.path.exists(path):
+            self._create(path, capacity)
+
+        self._fd = os.open(path, os.O_RDWR)
+        size = os.fstat(self._fd).st_size
+        if size < _HEADER.size:
+            os.close(self._fd)
+            raise HotStoreError('invalid store file : %s' % path)
+        self._mm = mmap.mmap(self._fd, size)
+        magic, version, self.capacity, _ = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or size != _HEADER.size + self.capacity * _SLOT_SIZE:
+            self.close()
+            raise HotStoreError('invalid store file : %s' % path)
+
+        # name -> slot offset
+        self._index = {}
+        # names by slot number
+        self._names = []
+        self._indexed = 0
+        # bulk readers of slots, by number of slots
+        self._bulk_structs = {}
+
+    @staticmethod
+    def _create(path, capacity):
+        # the file is built aside and renamed, so that readers never see a partial one
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as fp:
+            fp.write(_HEADER.pack(MAGIC, VERSION, capacity, 0))
+            fp.write('\0' * (capacity * _SLOT_SIZE))
+        try:
+            # fails if another process has created it in between, in which case its file is kept
+            os.link(tmp_path, path)
+        except OSError:
+            pass
+        os.remove(tmp_path)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+            os.close(self._fd)
+
+    def _used(self):
+        return _SEQ.unpack_from(self._mm, _USED_OFFSET)[0]
+
+    def _refresh_index(self):
+        """ Adds the slots allocated since the last call to the index."""
+        used = self._used()
+        for i in range(self._indexed, used):
+            offset = _HEADER.size + i * _SLOT_SIZE
+            name = _NAME.unpack_from(self._mm, offset + _NAME_OFFSET)[0].rstrip('\0').decode('utf-8')
+            self._index[name] = offset
+            self._names.append(name)
+        self._indexed = used
+
+    def _slot(self, name):
+        offset = self._index.get(name)
+        if offset is None and self._used() > self._indexed:
+            self._refresh_index()
+            offset = self._index.get(name)
+        return offset
+
+    def _allocate(self, name):
+        encoded = name.encode('utf-8')
+        if len(encoded) > MAX_NAME_LENGTH:
+            raise ValueError('variable name too long : %s' % name)
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # the variable may have been allocated by another writer in between
+            self._refresh_index()
+            if name in self._index:
+                return self._index[name]
+            used = self._used()
+            if used >= self.capacity:
+                raise HotStoreError('store is full')
+            offset = _HEADER.size + used * _SLOT_SIZE
+            _NAME.pack_into(self._mm, offset + _NAME_OFFSET, encoded)
+            # the slot is published once its name is written
+            _SEQ.pack_into(self._mm, _USED_OFFSET, used + 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        self._refresh_index()
+        return offset
+
+    def put(self, name, value, timestamp=None):
+        """ Stores the latest value of a variable.
+
+        :Parameters:
+            name : unicode
+                the variable name
+            value : float
+                the value
+            timestamp : float
+                the time of the value (default: now)
+        """
+        offset = self._slot(name)
+        if offset is None:
+            offset = self._allocate(name)
+
+        mm = self._mm
+        seq = _SEQ.unpack_from(mm, offset)[0]
+        _SEQ.pack_into(mm, offset, (seq + 1) & 0xffffffff)
+        _DATA.pack_into(mm, offset + _DATA_OFFSET, value, time.time() if timestamp is None else timestamp)
+        _SEQ.pack_into(mm, offset, (seq + 2) & 0xffffffff)
+
+    def _read(self, offset):
+        mm = self._mm
+        for _ in xrange(_MAX_READ_ATTEMPTS):
+            seq = _SEQ.unpack_from(mm, offset)[0]
+            if seq & 1:
+                continue
+            data = _DATA.unpack_from(mm, offset + _DATA_OFFSET)
+            if _SEQ.unpack_from(mm, offset)[0] == seq:
+                # never written slots have a null sequence
+                return data if seq else None
+        return None
+
+    def get(self, name):
+        """ Returns the (value, timestamp) tuple of a variable, or None if not available.
+
+        A variable which stays locked by its writer for too long (because the writer process
+        has been preempted in the middle of an update for instance) is considered as not available.
+        """
+        offset = self._slot(name)
+        if offset is None:
+            return None
+        return self._read(offset)
+
+    def items(self, names=None):
+        """ Returns the (name, value, timestamp) tuples of variables.
+
+        :Parameters:
+            names : iterable
+                the names of the variables (default: all the variables of the store).
+                Unknown ones are ignored.
+        """
+        if self._used() > self._indexed:
+            self._refresh_index()
+        if names is None:
+            return self._read_all()
+
+        result = []
+        for name in names:
+            offset = self._index.get(name)
+            if offset is None:
+                continue
+            data = self._read(offset)
+            if data is not None:
+                result.append((name, data[0], data[1]))
+        return result
+
+    def _read_all(self):
+        """ Reads all the slots at once, falling back to individual reads if some of them
+        were being written at the same time or have never been written.
+        """
+        count = self._indexed
+        if not count:
+            return []
+        readers = self._bulk_structs.get(count)
+        if readers is None:
+            readers = self._bulk_structs[count] = (
+                struct.Struct('<' + _SLOT_FORMAT * count), struct.Struct('<' + _SLOT_SEQ_FORMAT * count)
+            )
+
+        mm = self._mm
+        end = _HEADER.size + count * _SLOT_SIZE
+        fields = readers[0].unpack_from(mm, _HEADER.size)
+        # the sequences are read again after the data, as for single slot reads
+        seqs = readers[1].unpack_from(mm, _HEADER.size)
+        low_bytes = mm[_HEADER.size:end:_SLOT_SIZE]
+        if fields[0::3] == seqs and not low_bytes.translate(None, _EVEN_BYTES) and 0 not in seqs:
+            return zip(self._names, fields[1::3], fields[2::3])
+
+        result = []
+        for i, name in enumerate(self._names):
+            data = self._read(_HEADER.size + i * _SLOT_SIZE)
+            if data is not None:
+                result.append((name, data[0], data[1]))
+        return result
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Internal dispatch of requests.
+
+Requests are processed by the application exactly as if they had been received from the
+network (routing, handlers, logging, metrics,...), except that the reply is captured
+by an in-memory connection instead of being sent to a client.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+from collections import namedtuple
+
+from tornado import gen, httputil
+from tornado.concurrent import Future
+
+
+class InternalReply(namedtuple('InternalReply', 'status headers body reason')):
+    """ The reply of an internally dispatched request.
+
+    Included attributes:
+        - the reply HTTP status
+        - the reply headers, as a `tornado.httputil.HTTPHeaders` instance
+        - the reply body
+        - the reason phrase of the status
+    """
+
+
+class _ConnectionContext(object):
+    def __init__(self, remote_ip, protocol):
+        self.remote_ip = remote_ip
+        self.protocol = protocol
+
+
+def _done_future():
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+class InternalConnection(object):
+    """ The subset of `tornado.httputil.HTTPConnection` used by request handlers, storing
+    the reply in memory.
+    """
+    def __init__(self, remote_ip=None, protocol='http'):
+        self.context = _ConnectionContext(remote_ip, protocol)
+        self.status = None
+        self.reason = None
+        self.headers = None
+        self.chunks = []
+        self.finished = Future()
+
+    def set_close_callback(self, callback):
+        pass
+
+    def write_headers(self, start_line, headers, chunk=None, callback=None):
+        self.status = start_line.code
+        self.reason = start_line.reason
+        self.headers = headers
+        return self.write(chunk, callback=callback)
+
+    def write(self, chunk, callback=None):
+        if chunk:
+            self.chunks.append(chunk)
+        if callback:
+            callback()
+        return _done_future()
+
+    def finish(self):
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+    def close(self):
+        # used by handlers to abort a partially sent reply, which is returned as is
+        self.finish()
+
+
+@gen.coroutine
+def fetch(application, method, uri, headers=None, body=None, remote_ip=None, protocol='http'):
+    """ Dispatches a request to the application, and returns its reply.
+
+    This function is a coroutine.
+
+    :Parameters:
+        application : tornado.web.Application
+            the application
+        method : str
+            the request HTTP method
+        uri : str
+            the request URI (path and query string)
+        headers : dict
+            the request headers
+        body : str
+            the request body
+        remote_ip : str
+            the address of the client on behalf of which the request is made
+        protocol : str
+            the protocol used by this client
+
+    :returns: an InternalReply
+    """
+    connection = InternalConnection(remote_ip, protocol)
+    request = httputil.HTTPServerRequest(
+        method=method, uri=uri, version='HTTP/1.1',
+        headers=httputil.HTTPHeaders(headers or {}), body=body,
+        connection=connection
+    )
+    if body:
+        httputil.parse_body_arguments(
+            request.headers.get('Content-Type', ''), request.body,
+            request.body_arguments, request.files, request.headers
+        )
+        for name, values in request.body_arguments.items():
+            request.arguments.setdefault(name, []).extend(values)
+
+    application.find_handler(request).execute()
+    yield connection.finished
+    raise gen.Return(InternalReply(
+        connection.status, connection.headers, b''.join(connection.chunks), connection.reason
+    ))
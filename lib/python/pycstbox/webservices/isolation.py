@@ -0,0 +1,512 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Hosting of services in dedicated processes.
+
+A service flagged as isolated in its manifest is not imported by the server. It is run
+instead by a child process, started with this module as main program, and the server
+forwards the requests addressed to the service to this process. A service leaking memory
+or hogging the CPU thus does not slow down the other ones.
+
+The server and the child process communicate over a local socket (the child standard
+input), on which requests and replies are exchanged as frames made of (little endian) :
+    - a header : request id (uint32), metadata length (uint32), body length (uint32)
+    - the metadata, as a JSON list : [method, uri, headers, remote ip, protocol] for
+    requests, [status, reason, headers] for replies, headers being lists of (name, value)
+    pairs
+    - the body
+Several requests can be in progress at the same time on the socket, replies being matched
+with requests by their id. The child process sends a frame with the id 0 once ready.
+Before that, the server sends the child process its options (including the application
+settings) in a frame with the id 0, so that they are not exposed on its command line.
+Requests with the `RUNTIME` method are answered by the child process itself, with the JSON
+report of its server loop monitor (see :py:mod:`pycstbox.webservices.loopmonitor`).
+
+The child process is restarted when it terminates unexpectedly, the requests in progress
+failing with a 503 status. If a memory budget is set, the process is also replaced when its
+resident memory exceeds it : a new process is started for the next requests, and the
+previous one is stopped once its requests in progress are completed.
+
+In multi-process mode, each worker process has its own child processes. Push channels are
+not available to isolated services, and their streamed replies are sent at once when
+complete.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+import tornado.ioloop
+import tornado.iostream
+from tornado import gen
+from tornado.concurrent import Future
+
+from pycstbox.webservices.internal import fetch
+
+_FRAME = struct.Struct('<III')
+_READY_ID = 0
+_MAX_REQUEST_ID = 0xffffffff
+# method of the requests for the runtime report of the child process
+_RUNTIME_METHOD = 'RUNTIME'
+
+# headers which are not forwarded, since they relate to the connection with the client
+HOP_BY_HOP_HEADERS = frozenset((
+    'Connection', 'Keep-Alive', 'Transfer-Encoding', 'Content-Length', 'Date', 'Server', 'Expect'
+))
+
+DEFAULT_REQUEST_TIMEOUT = 60.
+DEFAULT_START_TIMEOUT = 30.
+MEMORY_CHECK_INTERVAL = 5.
+# delay before restarting a crashed process, doubled at each consecutive crash
+RESTART_DELAY = 1.
+MAX_RESTART_DELAY = 30.
+# time given to a replaced process to complete its requests in progress
+RETIRE_TIMEOUT = 30.
+# time given to a process to exit when the server stops
+STOP_TIMEOUT = 2.
+
+
+class ServiceUnavailable(Exception):
+    """ Raised when the process of an isolated service cannot process a request."""
+
+
+def encode_frame(request_id, meta, body=b''):
+    meta = json.dumps(meta, separators=(',', ':'), encoding='latin-1')
+    return _FRAME.pack(request_id, len(meta), len(body)) + meta + body
+
+
+@gen.coroutine
+def read_frame(stream):
+    """ Reads a frame from a stream, and returns its (request id, metadata, body) tuple.
+
+    This function is a coroutine.
+
+    :raises tornado.iostream.StreamClosedError: if the connection is closed
+    """
+    request_id, meta_length, body_length = _FRAME.unpack((yield stream.read_bytes(_FRAME.size)))
+    data = yield stream.read_bytes(meta_length + body_length)
+    raise gen.Return((request_id, json.loads(data[:meta_length]), data[meta_length:]))
+
+
+def _headers_list(headers):
+    return [(n, v) for n, v in headers.get_all() if n not in HOP_BY_HOP_HEADERS]
+
+
+def _native(value):
+    # JSON decoding returns unicode strings, while the HTTP ones are bytes in Python 2
+    return value.encode('latin-1') if isinstance(value, unicode) else value
+
+
+def _native_headers(headers):
+    return [(_native(n), _native(v)) for n, v in headers]
+
+
+def process_rss(pid):
+    """ Returns the resident memory of a process in bytes, or None if not available."""
+    try:
+        with open('/proc/%d/statm' % pid) as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+class _Channel(object):
+    """ A child process and the connection with it.
+    """
+    def __init__(self, popen, stream):
+        self.popen = popen
+        self.stream = stream
+        self.started = time.time()
+        self.ready = Future()
+        self.retired = False
+        self._pending = {}
+        self._last_id = _READY_ID
+
+    @property
+    def pid(self):
+        return self.popen.pid
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def send(self, meta, body):
+        """ Sends a request, and returns its id and the future resolving to its reply, or
+        to None if the connection is lost before.
+        """
+        self._last_id = self._last_id % _MAX_REQUEST_ID + 1
+        future = self._pending[self._last_id] = Future()
+        self.stream.write(encode_frame(self._last_id, meta, body))
+        return self._last_id, future
+
+    def cancel(self, request_id):
+        """ Forgets a request which reply is no longer waited for. The reply is ignored
+        if it comes later.
+        """
+        self._pending.pop(request_id, None)
+        self.close_if_idle()
+
+    def close_if_idle(self):
+        """ Closes the connection of a retired process once its requests are completed."""
+        if self.retired and not self._pending:
+            self.stream.close()
+
+    def resolve(self, request_id, reply):
+        future = self._pending.pop(request_id, None)
+        if future is not None:
+            future.set_result(reply)
+
+    def fail_all(self):
+        # failures are reported with a None result, since the futures of timed out requests
+        # have no more consumer to retrieve an exception
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_result(None)
+        if not self.ready.done():
+            self.ready.set_result(False)
+
+
+class ServiceProcess(object):
+    """ Manages the child process hosting an isolated service, and forwards requests to it.
+
+    It must be used from the server loop thread only.
+    """
+    def __init__(self, service_name, command, logger, memory_limit=None,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT, start_timeout=DEFAULT_START_TIMEOUT, options=None):
+        """
+        :Parameters:
+            service_name : str
+                the name of the service
+            command : list
+                the command line of the child process
+            logger : logging.Logger
+                the logger used to report the process life cycle
+            memory_limit : int
+                the resident memory beyond which the process is replaced, in bytes
+                (default: no limit)
+            request_timeout : float
+                the maximum processing time of a request, in seconds
+            start_timeout : float
+                the maximum time given to the process to be ready, in seconds
+            options : dict
+                the options sent to the child process once started, as expected by
+                :py:func:`main`
+        """
+        self.service_name = service_name
+        self.command = command
+        self.options = options
+        self.memory_limit = memory_limit
+        self.request_timeout = request_timeout
+        self.start_timeout = start_timeout
+        self._logger = logger
+        self._channel = None
+        self._retired = set()
+        self._stopping = False
+        self._restart_delay = RESTART_DELAY
+        self._restart_handle = None
+        self._memory_check = None
+        self.restarts = 0
+
+    def start(self):
+        """ Starts the child process, and the memory supervision if a budget is set."""
+        self._spawn()
+        if self.memory_limit and self._memory_check is None:
+            self._memory_check = tornado.ioloop.PeriodicCallback(self._check_memory, MEMORY_CHECK_INTERVAL * 1000)
+            self._memory_check.start()
+
+    def _spawn(self):
+        self._restart_handle = None
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            # the socket is passed as the standard input, all the other descriptors being closed
+            popen = subprocess.Popen(self.command, stdin=child_sock.fileno(), close_fds=True)
+        except OSError as e:
+            parent_sock.close()
+            self._logger.error("cannot start process of service '%s' (%s)", self.service_name, e)
+            self._schedule_restart()
+            return
+        finally:
+            child_sock.close()
+
+        channel = self._channel = _Channel(popen, tornado.iostream.IOStream(parent_sock))
+        channel.stream.write(encode_frame(_READY_ID, self.options))
+        self._logger.info("process of service '%s' started (pid=%d)", self.service_name, channel.pid)
+        self._read_replies(channel)
+
+    @gen.coroutine
+    def _read_replies(self, channel):
+        try:
+            while True:
+                request_id, meta, body = yield read_frame(channel.stream)
+                if request_id == _READY_ID:
+                    channel.ready.set_result(True)
+                else:
+                    channel.resolve(request_id, (meta, body))
+                    channel.close_if_idle()
+        except tornado.iostream.StreamClosedError:
+            pass
+        self._on_channel_closed(channel)
+
+    def _on_channel_closed(self, channel):
+        channel.fail_all()
+        self._retired.discard(channel)
+        self._reap(channel)
+        if channel is not self._channel:
+            return
+
+        self._channel = None
+        if self._stopping:
+            return
+        self._logger.error("process of service '%s' (pid=%d) terminated unexpectedly",
+                           self.service_name, channel.pid)
+        if time.time() - channel.started > MAX_RESTART_DELAY:
+            self._restart_delay = RESTART_DELAY
+        self._schedule_restart()
+
+    def _schedule_restart(self):
+        if self._stopping or self._restart_handle is not None:
+            return
+        self.restarts += 1
+        self._logger.info("restarting process of service '%s' in %.1fs", self.service_name, self._restart_delay)
+        self._restart_handle = tornado.ioloop.IOLoop.current().call_later(self._restart_delay, self._spawn)
+        self._restart_delay = min(self._restart_delay * 2, MAX_RESTART_DELAY)
+
+    def _reap(self, channel, attempts=10):
+        """ Collects the exit status of a terminated process, waiting for it if needed."""
+        if channel.popen.poll() is not None:
+            self._logger.info("process of service '%s' (pid=%d) exited with status %d",
+                              self.service_name, channel.pid, channel.popen.returncode)
+            return
+        if not attempts:
+            self._kill(channel)
+            return
+        tornado.ioloop.IOLoop.current().call_later(0.5, self._reap, channel, attempts - 1)
+
+    @staticmethod
+    def _kill(channel):
+        try:
+            channel.popen.kill()
+            channel.popen.wait()
+        except OSError:
+            pass
+
+    def _check_memory(self):
+        channel = self._channel
+        if channel is None or not channel.ready.done():
+            return
+        rss = process_rss(channel.pid)
+        if rss is None or rss <= self.memory_limit:
+            return
+        self._logger.warning("process of service '%s' (pid=%d) uses %d MB, above its budget => replaced",
+                             self.service_name, channel.pid, rss / (1024 * 1024))
+        self.restarts += 1
+        self._retire(channel)
+        self._spawn()
+
+    def _retire(self, channel):
+        """ Stops a process once its requests in progress are completed."""
+        channel.retired = True
+        self._retired.add(channel)
+        channel.close_if_idle()
+        if channel.stream.closed():
+            return
+
+        def force_stop():
+            if not channel.stream.closed():
+                self._logger.warning("process of service '%s' (pid=%d) still busy => killed",
+                                     self.service_name, channel.pid)
+                self._kill(channel)
+                channel.stream.close()
+        tornado.ioloop.IOLoop.current().call_later(RETIRE_TIMEOUT, force_stop)
+
+    @gen.coroutine
+    def fetch(self, method, uri, headers, body, remote_ip, protocol):
+        """ Forwards a request to the child process.
+
+        This method is a coroutine.
+
+        :returns: the (status, reason, headers, body) tuple of the reply
+        :raises ServiceUnavailable: if the process is not available
+        :raises tornado.gen.TimeoutError: if the reply is not received in time
+        """
+        (status, reason, reply_headers), reply_body = yield self._exchange(
+            [method, uri, _headers_list(headers), remote_ip, protocol], body
+        )
+        raise gen.Return((status, _native(reason), _native_headers(reply_headers), reply_body))
+
+    @gen.coroutine
+    def runtime(self):
+        """ Returns the runtime report of the child process, or None if not available.
+
+        This method is a coroutine.
+        """
+        try:
+            (status, _, _), body = yield self._exchange([_RUNTIME_METHOD, '', [], None, None], None)
+        except (ServiceUnavailable, gen.TimeoutError):
+            raise gen.Return(None)
+        raise gen.Return(json.loads(body) if status == 200 else None)
+
+    @gen.coroutine
+    def _exchange(self, meta, body):
+        """ Sends a request to the child process, and returns the (metadata, body) pair
+        of its reply.
+
+        This method is a coroutine.
+        """
+        channel = self._channel
+        if channel is None:
+            raise ServiceUnavailable('service process not running')
+        if not channel.ready.done():
+            try:
+                yield gen.with_timeout(timedelta(seconds=self.start_timeout), channel.ready)
+            except gen.TimeoutError:
+                raise ServiceUnavailable('service process not ready')
+        if not channel.ready.result() or channel.stream.closed():
+            raise ServiceUnavailable('service process not running')
+
+        try:
+            request_id, future = channel.send(meta, body or b'')
+        except tornado.iostream.StreamClosedError:
+            raise ServiceUnavailable('service process terminated')
+        try:
+            reply = yield gen.with_timeout(timedelta(seconds=self.request_timeout), future)
+        except gen.TimeoutError:
+            channel.cancel(request_id)
+            raise
+        if reply is None:
+            raise ServiceUnavailable('service process terminated')
+        raise gen.Return(reply)
+
+    def status(self):
+        """ Returns the process status, as a dictionary."""
+        channel = self._channel
+        return {
+            'pid': channel.pid if channel else None,
+            'rss': process_rss(channel.pid) if channel else None,
+            'pending': channel.pending_count() if channel else 0,
+            'restarts': self.restarts
+        }
+
+    def stop(self):
+        """ Stops the child processes, killing the ones which do not exit in time.
+
+        It is called once the server loop is stopped, and thus waits synchronously.
+        """
+        self._stopping = True
+        if self._memory_check:
+            self._memory_check.stop()
+            self._memory_check = None
+        channels = list(self._retired) + ([self._channel] if self._channel else [])
+        for channel in channels:
+            # the process exits when the connection is closed
+            channel.stream.close()
+        deadline = time.time() + STOP_TIMEOUT
+        for channel in channels:
+            while channel.popen.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if channel.popen.poll() is None:
+                self._kill(channel)
+
+
+@gen.coroutine
+def _process(application, stream, request_id, meta, body, logger, reporter):
+    method, uri, headers, remote_ip, protocol = meta
+    method, uri, remote_ip, protocol = _native(method), _native(uri), _native(remote_ip), _native(protocol)
+    try:
+        if method == _RUNTIME_METHOD:
+            frame = encode_frame(request_id, [200, 'OK', []], json.dumps(reporter() if reporter else None))
+        else:
+            reply = yield fetch(application, method, uri, _native_headers(headers), body or None, remote_ip, protocol)
+            frame = encode_frame(request_id, [reply.status, reply.reason, _headers_list(reply.headers)], reply.body)
+    except Exception as e:   #pylint: disable=W0703
+        logger.exception(e)
+        frame = encode_frame(request_id, [500, 'Internal Server Error', []])
+    try:
+        stream.write(frame)
+    except tornado.iostream.StreamClosedError:
+        pass
+
+
+@gen.coroutine
+def serve(application, sock, logger, reporter=None):
+    """ Processes the requests received from the server process, until it closes the connection.
+
+    This function is a coroutine, and is run by the child process.
+
+    :Parameters:
+        application : tornado.web.Application
+            the application of the isolated service
+        sock : socket.socket
+            the socket connected to the server process
+        logger : logging.Logger
+            the logger of the process
+        reporter : callable
+            the function returning the runtime report of the process, as a JSON serializable
+            object
+    """
+    stream = tornado.iostream.IOStream(sock)
+    stream.write(encode_frame(_READY_ID, [os.getpid()]))
+    try:
+        while True:
+            request_id, meta, body = yield read_frame(stream)
+            # requests are processed concurrently
+            _process(application, stream, request_id, meta, body, logger, reporter)
+    except tornado.iostream.StreamClosedError:
+        pass
+
+
+def child_command(service_name):
+    """ Returns the command line of the child process of an isolated service.
+
+    The command line only contains the service name, for identifying the process. The
+    other options are sent through the connection with the server process, since the
+    command line is readable by all the users of the system.
+
+    :Parameters:
+        service_name : str
+            the name of the service
+    """
+    return [sys.executable, '-m', 'pycstbox.webservices.isolation', service_name]
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError('connection closed by the server process')
+        data += chunk
+    return data
+
+
+def _recv_options(sock):
+    """ Returns the options sent by the server process in the first frame."""
+    _, meta_length, body_length = _FRAME.unpack(_recv_exactly(sock, _FRAME.size))
+    return json.loads(_recv_exactly(sock, meta_length + body_length)[:meta_length])
+
+
+def main():
+    from pycstbox.webservices.wsapp import AppServer
+
+    # the connection with the server process is passed as the standard input
+    sock = socket.fromfd(0, socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(0)
+    os.open(os.devnull, os.O_RDONLY)
+    options = _recv_options(sock)
+    # the parent process is in charge of the handovers
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    server = AppServer(**options['server'])
+    server.services_home = options['services_home']
+    server.serve_isolated(options['service'], sock, options['settings'], options['log_level'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" JSON encoding of the replies.
+
+The encoder uses the fastest JSON library available on the system, among the supported
+ones, and falls back to the standard library `json` module if none is installed.
+Whatever the library used, datetime, date and time objects are encoded as ISO 8601
+strings and Decimal objects are encoded as numbers. As done by Tornado `json_encode`,
+`</` sequences are escaped as `<\\/`, so that JSON data can be safely embedded in HTML
+`<script>` elements.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import datetime
+import decimal
+import functools
+import importlib
+
+# supported backends, in order of preference
+BACKENDS = ('orjson', 'ujson', 'simplejson', 'json')
+
+
+def _default(obj):
+    """ Encoding of types not natively supported by JSON libraries."""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+def _orjson_dumps(module, pretty):
+    option = module.OPT_INDENT_2 if pretty else 0
+    return functools.partial(module.dumps, default=_default, option=option)
+
+
+def _ujson_dumps(module, pretty):
+    return functools.partial(module.dumps, default=_default, indent=2 if pretty else 0)
+
+
+def _simplejson_dumps(module, pretty):
+    if pretty:
+        return functools.partial(module.dumps, default=_default, use_decimal=True, indent=2,
+                                 separators=(',', ': '), sort_keys=True)
+    return functools.partial(module.dumps, default=_default, use_decimal=True, separators=(',', ':'))
+
+
+def _json_dumps(module, pretty):
+    if pretty:
+        return functools.partial(module.dumps, default=_default, indent=2, separators=(',', ': '), sort_keys=True)
+    return functools.partial(module.dumps, default=_default, separators=(',', ':'))
+
+_factories = {
+    'orjson': _orjson_dumps,
+    'ujson': _ujson_dumps,
+    'simplejson': _simplejson_dumps,
+    'json': _json_dumps,
+}
+
+# data used to check that a backend supports all the features we need
+_PROBE = {'d': datetime.date(2000, 1, 1), 'n': decimal.Decimal('1.5')}
+
+
+def _load_backend(name, pretty):
+    """ Returns the dumps function for a backend, or None if it is not available
+    or does not support the required features (old ujson versions for instance).
+    """
+    try:
+        module = importlib.import_module(name)
+        dumps = _factories[name](module, pretty)
+        dumps(_PROBE)
+    except Exception:     #pylint: disable=W0703
+        return None
+    return dumps
+
+
+class JSONEncoder(object):
+    """ The replies JSON encoder.
+    """
+    def __init__(self, pretty=False, backend=None):
+        """
+        :Parameters:
+            pretty : bool
+                if True, the output is indented for readability. Otherwise it is as
+                compact as possible.
+            backend : str
+                the name of the backend to be used. If not provided, the best available one
+                is selected.
+
+        :raises ValueError: if the requested backend is not available
+        """
+        self.pretty = pretty
+        if backend:
+            if backend not in _factories:
+                raise ValueError('unsupported JSON backend : %s' % backend)
+            dumps = _load_backend(backend, pretty)
+            if not dumps:
+                raise ValueError('JSON backend not available : %s' % backend)
+        else:
+            backend, dumps = next(
+                (name, dumps) for name, dumps in ((n, _load_backend(n, pretty)) for n in BACKENDS) if dumps
+            )
+        self.backend = backend
+        self._dumps = dumps
+
+    def encode(self, data):
+        """ Returns the JSON representation of the data."""
+        return self._dumps(data).replace('</', '<\\/')
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Monitoring of the server loop responsiveness.
+
+All the requests of a process are served by a single loop, which is blocked as long as
+a handler runs synchronous code. The monitor measures the lag of a timer scheduled
+periodically in the loop, i.e. the delay between the time it should have run and the time
+it actually ran, which is the time the loop spent without being able to process events.
+
+When the loop is blocked longer than a threshold, a watchdog thread captures the stack of
+the loop thread while it is blocked, and the stall is recorded with this stack and with the
+route of the handler being run if any, once the loop is responsive again. The synchronous
+part of the handlers methods (i.e. up to their first `yield` for coroutines) is also timed,
+and the routes of the ones exceeding the threshold are counted, so that the handlers
+blocking the loop can be found.
+
+The records are kept in memory, in each process.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import tornado.ioloop
+
+DEFAULT_THRESHOLD = 0.1
+# period of the lag measurement, in seconds
+SAMPLE_INTERVAL = 0.1
+# number of lag samples kept for the statistics
+SAMPLES_KEPT = 600
+# number of stall records kept
+STALLS_KEPT = 50
+# maximum number of frames of the recorded stacks
+STACK_LIMIT = 30
+
+
+class LoopMonitor(object):
+    """ Measures the server loop lag, and records the stalls.
+    """
+    def __init__(self, logger, threshold=DEFAULT_THRESHOLD, interval=SAMPLE_INTERVAL):
+        """
+        :Parameters:
+            logger : logging.Logger
+                the logger the stalls are reported to
+            threshold : float
+                the blocking time beyond which a stall is recorded, in seconds
+            interval : float
+                the period of the lag measurement, in seconds
+        """
+        self._logger = logger
+        self.threshold = threshold
+        self.interval = interval
+        self._ioloop = None
+        self._loop_thread_id = None
+        self._timeout = None
+        self._expected = None
+        self._heartbeat = None
+        self._lags = deque(maxlen=SAMPLES_KEPT)
+        self._max_lag = 0.
+        self._stalls = deque(maxlen=STALLS_KEPT)
+        self._stalls_count = 0
+        # (heartbeat, route, stack) captured by the watchdog during the current stall
+        self._sample = None
+        # (route, start time) of the handler method being run
+        self._current = None
+        # [count, total time, max time] of the blocking handler invocations, by route
+        self._hot_spots = {}
+        self._watchdog = None
+        self._running = False
+
+    def start(self):
+        """ Starts the monitoring of the current loop.
+
+        In multi-process mode, this must be done in the workers, after the fork.
+        """
+        self._ioloop = tornado.ioloop.IOLoop.current()
+        self._loop_thread_id = threading.current_thread().ident
+        self._running = True
+        self._heartbeat = time.time()
+        self._schedule()
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog')
+        self._watchdog.daemon = True
+        self._watchdog.start()
+
+    def stop(self):
+        self._running = False
+        if self._timeout is not None:
+            self._ioloop.remove_timeout(self._timeout)
+            self._timeout = None
+        if self._watchdog is not None:
+            self._watchdog.join(1)
+            self._watchdog = None
+
+    def _schedule(self):
+        self._expected = self._ioloop.time() + self.interval
+        self._timeout = self._ioloop.call_at(self._expected, self._tick)
+
+    def _tick(self):
+        lag = max(0., self._ioloop.time() - self._expected)
+        previous_heartbeat, self._heartbeat = self._heartbeat, time.time()
+        self._lags.append(lag)
+        self._max_lag = max(self._max_lag, lag)
+
+        if lag > self.threshold:
+            sample = self._sample
+            # the sample can be a late one, captured for the previous stall
+            route, stack = sample[1:] if sample and sample[0] == previous_heartbeat else (None, None)
+            self._stalls_count += 1
+            self._stalls.append({
+                'time': self._heartbeat - lag,
+                'duration': lag,
+                'route': route,
+                'stack': stack
+            })
+            self._logger.warning("server loop blocked for %.0fms (route: %s)", 1000. * lag, route or 'none')
+        self._sample = None
+        self._schedule()
+
+    def _watch(self):
+        """ Watchdog thread body, capturing the stack of the loop thread when it is blocked."""
+        period = min(self.threshold / 2, self.interval)
+        captured = None
+        while self._running:
+            time.sleep(period)
+            heartbeat = self._heartbeat
+            if time.time() - heartbeat <= self.interval + self.threshold or captured == heartbeat:
+                continue
+            # one capture per stall, while the loop is still blocked
+            captured = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)  #pylint: disable=W0212
+            if frame is None:
+                continue
+            current = self._current
+            self._sample = (
+                heartbeat,
+                current[0] if current else None,
+                ''.join(traceback.format_stack(frame, limit=STACK_LIMIT))
+            )
+
+    def begin(self, route):
+        """ Signals the start of a handler method."""
+        self._current = (route, time.time())
+
+    def end(self):
+        """ Signals the end of a handler method, or of its synchronous part for coroutines."""
+        current, self._current = self._current, None
+        if current is None:
+            return
+        route, start_time = current
+        duration = time.time() - start_time
+        if duration > self.threshold:
+            stats = self._hot_spots.get(route)
+            if stats is None:
+                stats = self._hot_spots[route] = [0, 0., 0.]
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+
+    def report(self):
+        """ Returns the lag statistics, the blocking routes and the recent stalls, as a dictionary."""
+        lags = sorted(self._lags)
+        count = len(lags)
+        return {
+            'threshold': self.threshold,
+            'interval': self.interval,
+            'lag': {
+                'last': self._lags[-1] if count else None,
+                'p50': lags[count // 2] if count else None,
+                'p99': lags[min(count - 1, int(count * 0.99))] if count else None,
+                'max': self._max_lag,
+                'samples': count
+            },
+            'stalls_count': self._stalls_count,
+            'hot_spots': dict(
+                (route, {'count': calls, 'total': total, 'max': max_time})
+                for route, (calls, total, max_time) in self._hot_spots.items()
+            ),
+            # most recent first
+            'stalls': list(reversed(self._stalls))
+        }
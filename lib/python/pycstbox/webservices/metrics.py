@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Requests metrics collection.
+
+Request durations are accumulated in fixed-bucket histograms, per route pattern and per
+status class (2xx, 4xx,...), from which approximate percentiles are derived. The number
+of requests being processed is tracked per route pattern too.
+
+The collected data can be reported as a dictionary (for JSON replies) or in the
+Prometheus text exposition format.
+
+In multi-process mode, each worker process collects its own metrics.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import bisect
+
+# upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PERCENTILES = (50, 95, 99)
+
+METRICS_PREFIX = 'wsapi'
+
+
+class Histogram(object):
+    """ Fixed buckets histogram of durations.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # the last counter is for values above the last bucket bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p):
+        """ Returns the estimation of a percentile, interpolating linearly inside the
+        bucket containing it.
+
+        Values falling beyond the last bucket are estimated as the last bucket bound.
+        """
+        if not self.count:
+            return None
+        rank = self.count * p / 100.
+        cumulated = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulated + n >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.
+                return low + (self.buckets[i] - low) * (rank - cumulated) / n
+            cumulated += n
+        return self.buckets[-1]
+
+
+def _status_class(status):
+    return '%dxx' % (status // 100)
+
+
+class RequestMetrics(object):
+    """ The requests metrics registry.
+
+    It is not thread safe, and must be used from the server loop thread only.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._histograms = {}
+        self._in_flight = {}
+
+    def enter(self, route):
+        """ Signals the start of a request processing."""
+        self._in_flight[route] = self._in_flight.get(route, 0) + 1
+
+    def leave(self, route):
+        """ Signals the end of a request processing."""
+        self._in_flight[route] -= 1
+
+    def total_in_flight(self):
+        """ Returns the total number of requests being processed."""
+        return sum(self._in_flight.values())
+
+    def observe(self, route, status, duration):
+        """ Records a request processing.
+
+        :Parameters:
+            route : str
+                the pattern of the route the request matched
+            status : int
+                the reply status
+            duration : float
+                the request processing time, in seconds
+        """
+        key = (route, _status_class(status))
+        try:
+            histogram = self._histograms[key]
+        except KeyError:
+            histogram = self._histograms[key] = Histogram(self._buckets)
+        histogram.observe(duration)
+
+    def as_dict(self):
+        """ Returns the metrics as a dictionary, durations being expressed in milliseconds.
+        """
+        routes = {}
+        for (route, status_class), h in sorted(self._histograms.items()):
+            stats = {'count': h.count, 'mean': 1000. * h.sum / h.count}
+            for p in PERCENTILES:
+                stats['p%d' % p] = 1000. * h.percentile(p)
+            routes.setdefault(route, {'in_flight': self._in_flight.get(route, 0)})[status_class] = stats
+        for route, n in self._in_flight.items():
+            routes.setdefault(route, {'in_flight': n})
+        return {'routes': routes}
+
+    def as_prometheus(self):
+        """ Returns the metrics in Prometheus text exposition format.
+        """
+        def escape(s):
+            return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        name = METRICS_PREFIX + '_request_duration_seconds'
+        lines = [
+            '# HELP %s Requests processing time.' % name,
+            '# TYPE %s histogram' % name
+        ]
+        for (route, status_class), h in sorted(self._histograms.items()):
+            labels = 'route="%s",status="%s"' % (escape(route), status_class)
+            cumulated = 0
+            for bound, n in zip(self._buckets, h.counts):
+                cumulated += n
+                lines.append('%s_bucket{%s,le="%r"} %d' % (name, labels, bound, cumulated))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, h.count))
+            lines.append('%s_sum{%s} %r' % (name, labels, h.sum))
+            lines.append('%s_count{%s} %d' % (name, labels, h.count))
+
+        name = METRICS_PREFIX + '_requests_in_flight'
+        lines.extend([
+            '# HELP %s Requests being processed.' % name,
+            '# TYPE %s gauge' % name
+        ])
+        for route, n in sorted(self._in_flight.items()):
+            lines.append('%s{route="%s"} %d' % (name, escape(route), n))
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" On demand profiling of requests.
+
+Profiling is enabled by setting the `profile_token` application setting. A request carrying
+this token, either in the `X-Profile-Token` header or in the `_profile` query argument, then
+has its handler method run under `cProfile`. The top functions of the profile, sorted by
+cumulative time, are saved as a JSON record in a directory acting as a ring buffer, the
+oldest records being deleted when the configured count is reached. The record id is returned
+in the `X-Profile-Id` reply header. The `_profile` query argument is removed from the request
+URIs written in the logs and in the records.
+
+The following application settings are used :
+    - profile_token : the token authorizing the profiling (profiling disabled if not set)
+    - profile_dir : the directory the records are stored in (default: `wsapi-profiles` in
+    the system temporary directory)
+    - profile_keep : the maximum number of records kept (default: 20)
+    - profile_top : the number of functions included in the records (default: 30)
+
+For asynchronous handlers, the profiler is active in the server loop thread from the start
+of the handler method to the completion of the future it returns, so that the records also
+include the activity of the requests processed concurrently. For blocking handlers run in the
+executor pool, only the handler thread is profiled.
+
+Only one request is profiled at a time in a given process, concurrent profiling requests
+being processed normally.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import re
+import tempfile
+import time
+from cStringIO import StringIO
+
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_ARGUMENT = '_profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+# environment variable the server command reads the token from
+PROFILE_TOKEN_ENV = 'WSAPI_PROFILE_TOKEN'
+
+SETTING_PROFILE_TOKEN = 'profile_token'
+SETTING_PROFILE_DIR = 'profile_dir'
+SETTING_PROFILE_KEEP = 'profile_keep'
+SETTING_PROFILE_TOP = 'profile_top'
+
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'wsapi-profiles')
+DEFAULT_PROFILE_KEEP = 20
+DEFAULT_PROFILE_TOP = 30
+
+_ID_PATTERN = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9]+-[0-9]+$')
+_TOKEN_ARGUMENT_PATTERN = re.compile(r'(?<=[?&])%s=[^&]*(&|$)' % PROFILE_ARGUMENT)
+
+
+def redact_uri(uri):
+    """ Returns a request URI without the profiling token argument, if any."""
+    if PROFILE_ARGUMENT not in uri:
+        return uri
+    return _TOKEN_ARGUMENT_PATTERN.sub('', uri).rstrip('?&')
+
+
+class ProfileStore(object):
+    """ Controls the profiling of requests, and stores the resulting records.
+    """
+    def __init__(self, token, path=DEFAULT_PROFILE_DIR, keep=DEFAULT_PROFILE_KEEP, top=DEFAULT_PROFILE_TOP):
+        """
+        :Parameters:
+            token : str
+                the token authorizing the profiling
+            path : str
+                the directory the records are stored in
+            keep : int
+                the maximum number of records kept
+            top : int
+                the number of functions included in the records
+        """
+        self._token = str(token)
+        self.path = path
+        self.keep = keep
+        self.top = top
+        self._active = False
+        self._seq = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def is_authorized(self, token):
+        return token is not None and hmac.compare_digest(str(token), self._token)
+
+    def start(self):
+        """ Returns a new profiler, or None if a request is already being profiled."""
+        if self._active:
+            return None
+        self._active = True
+        return cProfile.Profile()
+
+    def save(self, profiler, infos):
+        """ Stores the record of a request profile.
+
+        :Parameters:
+            profiler : cProfile.Profile
+                the profiler returned by :py:meth:`start`
+            infos : dict
+                the request information included in the record
+
+        :returns: the id of the record
+        """
+        profiler.disable()
+        self._active = False
+
+        out = StringIO()
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(self.top)
+
+        self._seq += 1
+        now = time.time()
+        record_id = '%s-%d-%d' % (time.strftime('%Y%m%d-%H%M%S', time.localtime(now)), os.getpid(), self._seq)
+        record = dict(infos, id=record_id, time=now, total_time=stats.total_tt, summary=out.getvalue())
+        with open(os.path.join(self.path, record_id + '.json'), 'w') as fp:
+            json.dump(record, fp)
+
+        self._trim()
+        return record_id
+
+    def _record_files(self):
+        """ Returns the paths of the stored records, oldest first."""
+        paths = [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.json')]
+        return sorted(paths, key=os.path.getmtime)
+
+    def _trim(self):
+        for path in self._record_files()[:-self.keep]:
+            try:
+                os.remove(path)
+            except OSError:
+                # removed by another worker process
+                pass
+
+    def list(self):
+        """ Returns the stored records without their summary, most recent first."""
+        records = []
+        for path in reversed(self._record_files()):
+            try:
+                with open(path) as fp:
+                    record = json.load(fp)
+            except (IOError, ValueError):
+                continue
+            record.pop('summary', None)
+            records.append(record)
+        return records
+
+    def get(self, record_id):
+        """ Returns a stored record, or None if not found."""
+        if not _ID_PATTERN.match(record_id):
+            return None
+        try:
+            with open(os.path.join(self.path, record_id + '.json')) as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return None
+
+
+def create_store(settings):
+    """ Returns the profile store configured by the application settings, or None if
+    profiling is not enabled.
+    """
+    token = settings.get(SETTING_PROFILE_TOKEN)
+    if not token:
+        return None
+    return ProfileStore(
+        token,
+        path=settings.get(SETTING_PROFILE_DIR, DEFAULT_PROFILE_DIR),
+        keep=int(settings.get(SETTING_PROFILE_KEEP, DEFAULT_PROFILE_KEEP)),
+        top=int(settings.get(SETTING_PROFILE_TOP, DEFAULT_PROFILE_TOP))
+    )
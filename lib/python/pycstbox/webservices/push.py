@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Push of events to clients.
+
+Services publish events on their channel (named after the service) with :py:func:`publish`,
+and clients subscribe to it through long-lived connections, either a WebSocket or a
+Server-Sent Events stream, instead of polling the service endpoints.
+
+Events are encoded once when published, and then queued for each subscriber. Queues are
+bounded, so that a slow client cannot make the server memory grow. When the queue of a
+subscriber is full, the policy of the channel determines what happens :
+    - drop : the oldest pending event is discarded
+    - coalesce : pending events are keyed by their name, a new event replacing the pending
+    one with the same name. This suits events conveying a state (the last value of a
+    variable for instance), for which only the latest one matters. The oldest pending event
+    is discarded if the queue is full anyway.
+
+In multi-process mode, each worker process has its own subscribers, and events published
+in a worker only reach the clients connected to it.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+from collections import deque, OrderedDict
+from datetime import timedelta
+
+import tornado.ioloop
+import tornado.websocket
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.iostream import StreamClosedError
+
+from pycstbox.webservices.jsonenc import JSONEncoder
+
+POLICY_DROP = 'drop'
+POLICY_COALESCE = 'coalesce'
+POLICIES = (POLICY_DROP, POLICY_COALESCE)
+
+# MANIFEST settings keys used for configuring the push channel of a service
+SETTING_PUSH_QUEUE = 'push_queue'
+SETTING_PUSH_POLICY = 'push_policy'
+
+DEFAULT_QUEUE_SIZE = 100
+
+# delay after which a comment is sent on idle SSE streams, so that dead connections are detected
+SSE_KEEPALIVE = 30.
+
+
+class PushMessage(object):
+    """ An encoded event, shared by all the subscribers it is sent to."""
+    __slots__ = ('event', 'data', '_ws_frame', '_sse_frame')
+
+    def __init__(self, event, data):
+        """
+        :Parameters:
+            event : str
+                the event name (can be None)
+            data : str
+                the JSON encoded event data
+        """
+        self.event = event
+        self.data = data
+        self._ws_frame = self._sse_frame = None
+
+    def ws_frame(self, encoder):
+        if self._ws_frame is None:
+            self._ws_frame = '{"event":%s,"data":%s}' % (encoder.encode(self.event), self.data)
+        return self._ws_frame
+
+    def sse_frame(self):
+        if self._sse_frame is None:
+            head = ('event: %s\n' % self.event) if self.event else ''
+            self._sse_frame = head + ''.join('data: %s\n' % line for line in self.data.splitlines()) + '\n'
+        return self._sse_frame
+
+
+class Subscriber(object):
+    """ The bounded queue of the events pending for a client.
+
+    It is not thread safe, and must be used from the server loop thread only.
+    """
+    def __init__(self, channel, queue_size=DEFAULT_QUEUE_SIZE, policy=POLICY_DROP):
+        self.channel = channel
+        self.queue_size = queue_size
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self._queue = OrderedDict() if policy == POLICY_COALESCE else deque()
+        self._waiter = None
+
+    def push(self, message):
+        queue = self._queue
+        if self.policy == POLICY_COALESCE:
+            if message.event in queue:
+                del queue[message.event]
+                self.dropped += 1
+            elif len(queue) >= self.queue_size:
+                queue.popitem(last=False)
+                self.dropped += 1
+            queue[message.event] = message
+        else:
+            if len(queue) >= self.queue_size:
+                queue.popleft()
+                self.dropped += 1
+            queue.append(message)
+        self._wake_up()
+
+    def _pop(self):
+        if self.policy == POLICY_COALESCE:
+            return self._queue.popitem(last=False)[1]
+        return self._queue.popleft()
+
+    def get(self):
+        """ Returns a future resolving to the next pending event, or to None once the
+        subscriber is closed.
+        """
+        if self._waiter is not None:
+            # a previous wait has been given up (on a timeout for instance)
+            return self._waiter
+        future = Future()
+        if self._queue:
+            future.set_result(self._pop())
+        elif self.closed:
+            future.set_result(None)
+        else:
+            self._waiter = future
+        return future
+
+    def _wake_up(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(self._pop() if self._queue else None)
+
+    def close(self):
+        self.closed = True
+        self._queue.clear()
+        self._wake_up()
+
+
+class PushHub(object):
+    """ Registry of the channels subscribers.
+    """
+    def __init__(self, encoder=None):
+        self.encoder = encoder or JSONEncoder()
+        self._subscribers = {}
+        self._channels_config = {}
+
+    def configure(self, channel, queue_size=DEFAULT_QUEUE_SIZE, policy=POLICY_DROP):
+        """ Sets the queue size and overflow policy of the subscribers of a channel."""
+        if policy not in POLICIES:
+            raise ValueError('invalid push policy : %s' % policy)
+        self._channels_config[channel] = (queue_size, policy)
+
+    def subscribe(self, channel):
+        queue_size, policy = self._channels_config.get(channel, (DEFAULT_QUEUE_SIZE, POLICY_DROP))
+        subscriber = Subscriber(channel, queue_size, policy)
+        self._subscribers.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscribers = self._subscribers.get(subscriber.channel)
+        if subscribers:
+            subscribers.discard(subscriber)
+        subscriber.close()
+
+    def close_all(self):
+        """ Closes all the subscribers, which terminates the push connections."""
+        for subscribers in self._subscribers.values():
+            for subscriber in list(subscribers):
+                subscriber.close()
+        self._subscribers.clear()
+
+    def subscribers_count(self, channel):
+        return len(self._subscribers.get(channel, ()))
+
+    def publish(self, channel, event, data):
+        """ Publishes an event to the subscribers of a channel.
+
+        The data are encoded immediately, and the event is then dispatched in the server
+        loop. This method can thus be called from any thread.
+
+        :Parameters:
+            channel : str
+                the channel name (the one of the publishing service)
+            event : str
+                the event name (can be None)
+            data :
+                the event data, which must be JSON serializable
+        """
+        if not self._subscribers.get(channel):
+            return
+        message = PushMessage(event, self.encoder.encode(data))
+        if tornado.ioloop.IOLoop.current(instance=False) is None:
+            tornado.ioloop.IOLoop.instance().add_callback(self._dispatch, channel, message)
+        else:
+            self._dispatch(channel, message)
+
+    def _dispatch(self, channel, message):
+        for subscriber in list(self._subscribers.get(channel, ())):
+            subscriber.push(message)
+
+
+# the hub used by the server
+hub = PushHub()
+
+
+def publish(channel, event, data):
+    """ Publishes an event on the server hub. See :py:meth:`PushHub.publish`."""
+    hub.publish(channel, event, data)
+
+
+class PushWebSocketHandler(tornado.websocket.WebSocketHandler):
+    """ Sends the events of a channel through a WebSocket.
+
+    Each event is sent as a text message containing the JSON object `{"event": ..., "data": ...}`.
+    Messages received from the client are ignored.
+    """
+    _subscriber = None
+
+    def open(self, channel):    #pylint: disable=W0221
+        if not self.application.app_server.has_service(channel):
+            self.close(4004, 'unknown channel')
+            return
+        self._subscriber = hub.subscribe(channel)
+        self._pump()
+
+    @gen.coroutine
+    def _pump(self):
+        subscriber = self._subscriber
+        while True:
+            message = yield subscriber.get()
+            if message is None:
+                break
+            try:
+                # waiting for the message being written applies the back pressure on the queue
+                yield self.write_message(message.ws_frame(hub.encoder))
+            except (tornado.websocket.WebSocketClosedError, StreamClosedError):
+                break
+        hub.unsubscribe(subscriber)
+        # no-op if already closed by the client
+        self.close()
+
+    def on_message(self, message):
+        pass
+
+    def on_close(self):
+        if self._subscriber:
+            hub.unsubscribe(self._subscriber)
+
+
+class PushEventsHandler(tornado.web.RequestHandler):
+    """ Sends the events of a channel as a Server-Sent Events stream.
+    """
+    _subscriber = None
+
+    def prepare(self):
+        # compressing the stream would delay the events delivery
+        self._transforms = []
+
+    @gen.coroutine
+    def get(self, channel):    #pylint: disable=W0221
+        if not self.application.app_server.has_service(channel):
+            raise tornado.web.HTTPError(404)
+
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self._subscriber = subscriber = hub.subscribe(channel)
+        try:
+            yield self.flush()
+            while True:
+                try:
+                    message = yield gen.with_timeout(timedelta(seconds=SSE_KEEPALIVE), subscriber.get())
+                except gen.TimeoutError:
+                    self.write(': keepalive\n\n')
+                else:
+                    if message is None:
+                        break
+                    self.write(message.sse_frame())
+                yield self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            hub.unsubscribe(subscriber)
+
+    def on_connection_close(self):
+        if self._subscriber:
+            hub.unsubscribe(self._subscriber)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Batch requests service.
+
+Allows clients to group several API calls in a single HTTP request. The request body
+is a JSON list of sub-requests, each one being a dictionary with the following keys :
+    - path : the absolute path of the called URL (ex: `/api/_diags/hello`)
+    - method : the HTTP method (optional, default: GET)
+    - args : a dictionary of query arguments (optional)
+    - body : the request body for POST and PUT methods, which is sent as JSON (optional)
+
+Sub-requests are dispatched internally through the server routing table, and
+are processed concurrently. The reply is a JSON array containing, in the same order,
+a dictionary for each sub-request with its `status` and `body`. JSON bodies are
+included as is, other ones as strings, and empty ones as null. Sub-requests are always
+made with JSON as the accepted reply format, and cannot address the services push channels.
+"""
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+import json
+import urllib
+from datetime import timedelta
+
+from tornado import gen
+from tornado.web import HTTPError
+
+from pycstbox import log
+from pycstbox.webservices.wsapp import WSHandler
+from pycstbox.webservices.internal import fetch
+
+_ALLOWED_METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+
+# request headers not forwarded to sub-requests
+_DROPPED_HEADERS = ('Accept', 'Accept-Encoding', 'Content-Length', 'Content-Type', 'If-None-Match', 'Transfer-Encoding')
+
+_config = {
+    'max_requests': 50,
+    'timeout': 30.
+}
+
+
+def _init_(logger=None, settings=None):
+    """ Module init function, called by the application framework during the
+    services discovery process."""
+
+    # inject the logger in handlers default initialize parameters
+    _handlers_initparms['logger'] = logger if logger else log.getLogger('svc.batch')
+
+    if settings:
+        _config['max_requests'] = int(settings.get('max_requests', _config['max_requests']))
+        _config['timeout'] = float(settings.get('timeout', _config['timeout']))
+
+
+class BatchHandler(WSHandler):
+    @gen.coroutine
+    def do_post(self, *args, **kwargs):
+        try:
+            requests = json.loads(self.request.body)
+        except ValueError:
+            raise HTTPError(400, 'request body is not valid JSON')
+        if not isinstance(requests, list):
+            raise HTTPError(400, 'request body must be a list of sub-requests')
+        if len(requests) > _config['max_requests']:
+            raise HTTPError(400, 'too many sub-requests (max=%d)' % _config['max_requests'])
+
+        replies = yield [self._process_subrequest(sub) for sub in requests]
+
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write('[' + ','.join(replies) + ']')
+
+    def _encode_reply(self, status, body=None):
+        return '{"status":%d,"body":%s}' % (status, body or 'null')
+
+    def _encode_error(self, status, message):
+        return self._encode_reply(status, self.application.app_server.json_encoder.encode({'message': message}))
+
+    @gen.coroutine
+    def _process_subrequest(self, sub):
+        """ Processes a sub-request, and returns the JSON representation of its reply."""
+        if not isinstance(sub, dict) or not isinstance(sub.get('path'), basestring) \
+                or not isinstance(sub.get('method', 'GET'), basestring):
+            raise gen.Return(self._encode_error(400, 'invalid sub-request'))
+
+        path = sub['path'].encode('utf-8')
+        method = sub.get('method', 'GET').upper()
+        if not path.startswith('/') or path.startswith(self.request.path):
+            raise gen.Return(self._encode_error(400, 'invalid sub-request path'))
+        if '/_push/' in path.split('?', 1)[0]:
+            # streamed replies would never complete
+            raise gen.Return(self._encode_error(400, 'push channels not available in batches'))
+        if method not in _ALLOWED_METHODS:
+            raise gen.Return(self._encode_error(405, 'unsupported sub-request method'))
+
+        args = sub.get('args')
+        if args:
+            if not isinstance(args, dict):
+                raise gen.Return(self._encode_error(400, 'invalid sub-request arguments'))
+            args = dict(
+                (k.encode('utf-8'), [unicode(v).encode('utf-8') for v in (vs if isinstance(vs, list) else [vs])])
+                for k, vs in args.items()
+            )
+            path += ('&' if '?' in path else '?') + urllib.urlencode(args, doseq=True)
+
+        headers = dict((k, v) for k, v in self.request.headers.get_all() if k not in _DROPPED_HEADERS)
+        # replies are embedded in the JSON batch reply
+        headers['Accept'] = 'application/json'
+        body = None
+        if 'body' in sub:
+            body = self.application.app_server.json_encoder.encode(sub['body'])
+            headers['Content-Type'] = 'application/json; charset=UTF-8'
+
+        try:
+            reply = yield gen.with_timeout(
+                timedelta(seconds=_config['timeout']),
+                fetch(self.application, method, path, headers=headers, body=body,
+                      remote_ip=self.request.remote_ip, protocol=self.request.protocol)
+            )
+        except gen.TimeoutError:
+            raise gen.Return(self._encode_error(504, 'sub-request timeout'))
+
+        if not reply.body:
+            raise gen.Return(self._encode_reply(reply.status))
+        if reply.headers.get('Content-Type', '').startswith('application/json'):
+            raise gen.Return(self._encode_reply(reply.status, reply.body))
+        raise gen.Return(self._encode_reply(
+            reply.status, self.application.app_server.json_encoder.encode(reply.body.decode('utf-8', 'replace'))
+        ))
+
+_handlers_initparms = {}
+
+handlers = [
+    ("/", BatchHandler, _handlers_initparms),
+]
@@ -21,8 +21,17 @@
 __author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
 
 
+import gc
+import os
+import threading
+
+import tornado.web
+from tornado import gen
+
 from pycstbox import log
 from pycstbox.webservices.wsapp import WSHandler
+from pycstbox.webservices import profiling
+from pycstbox.webservices.isolation import process_rss
 
 
 def _init_(logger=None, settings=None):
@@ -33,6 +42,19 @@ def _init_(logger=None, settings=None):
     _handlers_initparms['logger'] = logger if logger else log.getLogger('svc.hello')
 
 
+def _is_authorized(handler):
+    """ Tells if a request provides the profiling token, which authorizes the
+    administration requests too.
+    """
+    store = handler.application.app_server.profiles
+    if store is None:
+        return False
+    token = handler.request.headers.get(profiling.PROFILE_HEADER) or handler.get_query_argument(
+        profiling.PROFILE_ARGUMENT, None
+    )
+    return store.is_authorized(token)
+
+
 class HelloHandler(WSHandler):
     def do_get(self):
         to_who = self.get_argument('to', 'World')
@@ -45,11 +67,111 @@ class RoutesHandler(WSHandler):
         routes = [handler[0] for handler in self.application.app_server._handlers]
         self.write({'routes': routes})
 
+
+class ServicesHandler(WSHandler):
+    def do_get(self, *args, **kwargs):
+        self.write({'services': self.application.app_server.get_services_status()})
+
+
+class CacheHandler(WSHandler):
+    """ Reports the replies cache statistics, or flushes the cache.
+
+    Flushing the cache requires the profiling token, and is thus not available if
+    profiling is not enabled.
+    """
+    def do_get(self, *args, **kwargs):
+        self.write(self.response_cache.stats())
+
+    def do_delete(self, *args, **kwargs):
+        if not _is_authorized(self):
+            raise tornado.web.HTTPError(403, 'invalid profiling token')
+        self.write({'invalidated': self.response_cache.invalidate()})
+
+
+class ProfilesHandler(WSHandler):
+    """ Lists the stored request profiles, or returns one of them if its id is given.
+
+    The profiling token must be provided, as for profiled requests.
+    """
+    profile_requests = False
+
+    def do_get(self, record_id=None):
+        store = self.application.app_server.profiles
+        if store is None:
+            raise tornado.web.HTTPError(404, 'profiling not enabled')
+        if not _is_authorized(self):
+            raise tornado.web.HTTPError(403, 'invalid profiling token')
+
+        if record_id is None:
+            self.write({'profiles': store.list()})
+            return
+        record = store.get(record_id)
+        if record is None:
+            raise tornado.web.HTTPError(404, 'profile not found')
+        if self.get_query_argument('format', None) == 'text':
+            self.set_header('Content-Type', 'text/plain; charset=utf-8')
+            self.write(record['summary'])
+        else:
+            self.write(record)
+
+
+class RuntimeHandler(WSHandler):
+    """ Reports the server loop lag, the stalls and the handlers blocking it (see
+    :py:mod:`pycstbox.webservices.loopmonitor`), with the process resources usage and the
+    garbage collector state.
+
+    The number of objects tracked by the garbage collector is included if the `objects`
+    argument is set, since counting them takes a significant time with large heaps.
+
+    The loop reports of the processes hosting the isolated services are included too, by
+    service name.
+    """
+    # must stay reachable when the server is overloaded
+    admission_control = False
+
+    @gen.coroutine
+    def do_get(self, *args, **kwargs):
+        app_server = self.application.app_server
+        monitor = app_server.loop_monitor
+        try:
+            fds = len(os.listdir('/proc/self/fd'))
+        except OSError:
+            fds = None
+        gc_stats = {
+            'enabled': gc.isenabled(),
+            'counts': gc.get_count(),
+            'thresholds': gc.get_threshold(),
+            'garbage': len(gc.garbage)
+        }
+        if self.get_argument('objects', None):
+            gc_stats['objects'] = len(gc.get_objects())
+        isolated = yield dict(
+            (name, process.runtime()) for name, process in app_server.get_service_processes().items()
+        )
+
+        self.write({
+            'pid': os.getpid(),
+            'loop': monitor.report() if monitor else None,
+            'process': {
+                'rss': process_rss(os.getpid()),
+                'connections': app_server.get_connections_count(),
+                'threads': threading.active_count(),
+                'fds': fds
+            },
+            'gc': gc_stats,
+            'isolated': isolated
+        })
+
 _handlers_initparms = {}
 
 handlers = [
     ("/hello", HelloHandler, _handlers_initparms),
     ("/routes", RoutesHandler, _handlers_initparms),
+    ("/services", ServicesHandler, _handlers_initparms),
+    ("/cache", CacheHandler, _handlers_initparms),
+    ("/profiles", ProfilesHandler, _handlers_initparms),
+    ("/profiles/([^/]+)", ProfilesHandler, _handlers_initparms),
+    ("/runtime", RuntimeHandler, _handlers_initparms),
 ]
 
 
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Concurrent execution of the services initialization functions.
+
+Initialization functions are run in daemon threads, a limited number of them being
+run at the same time. Each one is given a time limit, counted from the moment it actually
+starts. The ones exceeding it are abandoned: since a thread cannot be killed, they keep
+running in the background, but they no longer occupy a slot and do not prevent the
+process from exiting.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import threading
+import time
+import traceback
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class InitTask(object):
+    """ An initialization function call, and its outcome.
+
+    Once :py:func:`run_tasks` returns, exactly one of the following is true :
+        - `timed_out` is True
+        - `error` is not None, and `traceback` contains the formatted traceback
+        - the call completed successfully, `duration` giving the time it took (in seconds)
+        and `result` the value returned by the function
+    """
+    def __init__(self, name, func, kwargs, timeout=None):
+        """
+        :Parameters:
+            name : str
+                the name of the task (the one of the service)
+            func : callable
+                the function to be called
+            kwargs : dict
+                the keyword parameters of the call
+            timeout : float
+                the maximum duration of the call, in seconds (None or 0 for no limit)
+        """
+        self.name = name
+        self.func = func
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.start_time = None
+        self.duration = None
+        self.result = None
+        self.done = False
+        self.timed_out = False
+        self.error = None
+        self.traceback = None
+
+
+def run_tasks(tasks, max_workers=DEFAULT_MAX_WORKERS):
+    """ Runs initialization tasks concurrently, and returns when all of them are either
+    terminated or timed out.
+
+    :Parameters:
+        tasks : list of InitTask
+            the tasks to be run
+        max_workers : int
+            the maximum number of tasks running at the same time
+    """
+    cond = threading.Condition()
+    free_slots = [max_workers]
+
+    def run(task):
+        with cond:
+            while not free_slots[0]:
+                cond.wait()
+            free_slots[0] -= 1
+            task.start_time = time.time()
+            cond.notify_all()
+
+        try:
+            task.result = task.func(**task.kwargs)
+        except Exception as e:  #pylint: disable=W0703
+            task.error = e
+            task.traceback = traceback.format_exc()
+
+        with cond:
+            task.duration = time.time() - task.start_time
+            task.done = True
+            # the slot of a timed out task has already been given back
+            if not task.timed_out:
+                free_slots[0] += 1
+            cond.notify_all()
+
+    for task in tasks:
+        thread = threading.Thread(target=run, args=(task,), name='init-' + task.name)
+        thread.daemon = True
+        thread.start()
+
+    with cond:
+        while True:
+            now = time.time()
+            next_deadline = None
+            pending = False
+            for task in tasks:
+                if task.done or task.timed_out:
+                    continue
+                if task.start_time is None or not task.timeout:
+                    pending = True
+                    continue
+                deadline = task.start_time + task.timeout
+                if deadline <= now:
+                    task.timed_out = True
+                    free_slots[0] += 1
+                    cond.notify_all()
+                else:
+                    pending = True
+                    if next_deadline is None or deadline < next_deadline:
+                        next_deadline = deadline
+
+            if not pending:
+                return
+            cond.wait(None if next_deadline is None else next_deadline - now)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Asynchronous HTTP client shared by the services, for calling other daemons or devices.
+
+The client is owned by the server, and passed to the services `_init_` functions which
+accept an `http_client` parameter. Its `fetch` coroutine must be called from the server
+loop thread, i.e. from the `do_xxx` methods of handlers which are not run in the executor
+pool.
+
+It adds the following features to the Tornado asynchronous client :
+    - a limit on the number of concurrent requests per host, the requests exceeding it
+    waiting for a free slot
+    - default connection and request timeouts
+    - a circuit breaker per host : after a number of consecutive failures (connection
+    errors, timeouts or 5xx replies), the requests to the host fail immediately
+    with :py:class:`CircuitOpenError` during a given delay. A single trial request
+    is then let through, which closes the circuit if it succeeds.
+
+Connections are kept alive and reused if the `pycurl` package is installed, the curl based
+Tornado client being used in this case. The simple client, used otherwise, opens a
+connection per request.
+"""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import time
+import urlparse
+
+import tornado.httpclient
+import tornado.locks
+from tornado import gen
+
+try:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient as _ClientClass
+except ImportError:
+    # pycurl not available
+    _ClientClass = tornado.httpclient.AsyncHTTPClient
+
+DEFAULT_MAX_CLIENTS = 50
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_CONNECT_TIMEOUT = 5.
+DEFAULT_REQUEST_TIMEOUT = 20.
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.
+
+
+class CircuitOpenError(Exception):
+    """ Raised when a request is addressed to a host considered as failing."""
+
+
+class _HostState(object):
+    """ The concurrency gate and the circuit breaker state of a host."""
+    def __init__(self, max_connections):
+        self.semaphore = tornado.locks.Semaphore(max_connections)
+        self.failures = 0
+        self.open_until = None
+        self.trial_pending = False
+
+
+class UpstreamClient(object):
+    """ The shared HTTP client.
+    """
+    def __init__(self, max_clients=DEFAULT_MAX_CLIENTS, max_per_host=DEFAULT_MAX_PER_HOST,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT,
+                 clock=time.time):
+        """
+        :Parameters:
+            max_clients : int
+                the maximum number of requests processed at the same time
+            max_per_host : int
+                the maximum number of requests processed at the same time for a given host
+            connect_timeout : float
+                the default connection timeout, in seconds
+            request_timeout : float
+                the default request timeout, in seconds
+            failure_threshold : int
+                the number of consecutive failures opening the circuit of a host
+            reset_timeout : float
+                the delay after which a trial request is let through an open circuit, in seconds
+            clock : callable
+                the function returning the current time
+        """
+        self.max_clients = max_clients
+        self.max_per_host = max_per_host
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._client = None
+        self._hosts = {}
+
+    def _get_client(self):
+        # created on first use, so that it is bound to the loop of the (worker) process
+        if self._client is None:
+            self._client = _ClientClass(force_instance=True, max_clients=self.max_clients)
+        return self._client
+
+    def _check_circuit(self, host, state):
+        if state.open_until is None:
+            return
+        if self._clock() < state.open_until or state.trial_pending:
+            raise CircuitOpenError('circuit open for host %s' % host)
+        # half-open : the current request is the trial one
+        state.trial_pending = True
+
+    def _record_outcome(self, state, success):
+        state.trial_pending = False
+        if success:
+            state.failures = 0
+            state.open_until = None
+        else:
+            state.failures += 1
+            if state.failures >= self.failure_threshold:
+                state.open_until = self._clock() + self.reset_timeout
+
+    @gen.coroutine
+    def fetch(self, request, raise_error=True, **kwargs):
+        """ Executes a request.
+
+        This method is a coroutine, with the same parameters as
+        `tornado.httpclient.AsyncHTTPClient.fetch`.
+
+        :returns: the `tornado.httpclient.HTTPResponse` of the request
+        :raises CircuitOpenError: if the host circuit is open
+        """
+        if not isinstance(request, tornado.httpclient.HTTPRequest):
+            kwargs.setdefault('connect_timeout', self.connect_timeout)
+            kwargs.setdefault('request_timeout', self.request_timeout)
+            request = tornado.httpclient.HTTPRequest(url=request, **kwargs)
+
+        host = urlparse.urlsplit(request.url).netloc
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.max_per_host)
+
+        self._check_circuit(host, state)
+        with (yield state.semaphore.acquire()):
+            try:
+                response = yield self._get_client().fetch(request, raise_error=False)
+            except Exception:
+                self._record_outcome(state, False)
+                raise
+            self._record_outcome(state, response.code != 599 and response.code < 500)
+
+        if raise_error:
+            response.rethrow()
+        raise gen.Return(response)
+
+    def hosts_status(self):
+        """ Returns the circuit state of the hosts, as a dictionary."""
+        now = self._clock()
+        return dict(
+            (host, {
+                'failures': state.failures,
+                'circuit': 'closed' if state.open_until is None else ('open' if now < state.open_until else 'half-open')
+            })
+            for host, state in self._hosts.items()
+        )
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
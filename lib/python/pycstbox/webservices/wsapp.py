@@ -21,46 +21,304 @@ __author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
 import os
 import ConfigParser
 import importlib
+import inspect
 import signal
 import sys
 import re
+import errno
+import fcntl
+import socket
+import hashlib
+import functools
+import time
+import threading
 from collections import namedtuple
 
 import tornado.web
 import tornado.httpserver
+import tornado.httputil
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
+import tornado.routing
+from tornado import gen
+from tornado.concurrent import Future
+
+try:
+    # provided by the `futures` backport, and required by the executor mode only
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 from pycstbox import log, config, sysutils
+from pycstbox.webservices.cache import ResponseCache, CachedReply
+from pycstbox.webservices.coalescing import SingleFlight
+from pycstbox.webservices.compression import (
+    Compression, CompressionTransform, DEFAULT_MIN_SIZE as COMPRESSION_MIN_SIZE, DEFAULT_LEVEL as COMPRESSION_LEVEL
+)
+from pycstbox.webservices.jsonenc import JSONEncoder
+from pycstbox.webservices import formats
+from pycstbox.webservices.metrics import RequestMetrics
+from pycstbox.webservices import push
+from pycstbox.webservices import profiling
+from pycstbox.webservices import isolation
+from pycstbox.webservices.accesslog import AccessLogWriter
+from pycstbox.webservices.upstream import UpstreamClient
+from pycstbox.webservices.hotstore import HotStore, HotStoreError
+from pycstbox.webservices.loopmonitor import LoopMonitor, DEFAULT_THRESHOLD as LOOP_LAG_THRESHOLD
+from pycstbox.webservices.admission import (
+    AdmissionControl, SETTING_RATE_LIMIT, SETTING_RATE_BURST, SETTING_MAX_IN_FLIGHT
+)
+from pycstbox.webservices.startup import InitTask, run_tasks, DEFAULT_MAX_WORKERS
+from pycstbox.webservices.executor import (
+    ServiceExecutor, ServiceBusy, blocking, SETTING_EXECUTOR_SLOTS, SETTING_EXECUTOR_QUEUE, DEFAULT_QUEUE_SIZE
+)   # pylint: disable=W0611
 
 _here = os.path.dirname(__file__)
 
 MANIFEST_FILE_NAME = 'MANIFEST'
 MANIFEST_MAIN_SECTION = 'service'
 MANIFEST_SETTINGS_SECTION = 'settings'
+MANIFEST_INIT_OPTION = 'init'
+MANIFEST_INIT_TIMEOUT_OPTION = 'init_timeout'
+MANIFEST_LAZY_OPTION = 'lazy'
+MANIFEST_ROUTES_OPTION = 'routes'
+MANIFEST_ISOLATED_OPTION = 'isolated'
+MANIFEST_MEMORY_LIMIT_OPTION = 'memory_limit'
+INIT_BEFORE_FORK = 'before_fork'
+INIT_AFTER_FORK = 'after_fork'
 SERVICES_PACKAGE_NAME = 'pycstbox.webservices.services'
 
+# route under which the metrics of the requests not matching a known route are recorded
+UNKNOWN_ROUTE = '<unknown>'
+
+# amount of data accumulated by streamed replies before being sent
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# environment variables used to pass the listening sockets to the process taking over the server
+HANDOVER_FDS_ENV = 'WSAPI_LISTEN_FDS'
+HANDOVER_PID_ENV = 'WSAPI_HANDOVER_PID'
+
+# period of the in-flight requests check while draining, in seconds
+DRAIN_POLL_INTERVAL = 0.1
+
 
 class WSHandler(tornado.web.RequestHandler):
-    """ Web service base request handler """
+    """ Web service base request handler
+
+    Concrete handlers implement the `do_get`, `do_post`, `do_put` and `do_delete` methods
+    instead of the standard Tornado `get`, `post`,... ones. These methods can be either
+    plain methods, or coroutines (i.e. decorated by `tornado.gen.coroutine`) or methods
+    returning a future. In the latter cases, the request is completed when the
+    returned future resolves, without blocking the server loop in between. Error
+    handling and reply flushing are the same in both cases.
+
+    Methods wrapping blocking calls which cannot be made asynchronous can be marked with
+    the :py:func:`pycstbox.webservices.executor.blocking` decorator. They are then run in
+    the server thread pool if the owning service has enabled the executor mode (see
+    :py:meth:`AppServer._discover_services`). A 503 error is returned if the service
+    has too many calls pending in the pool.
+
+    Replies of GET requests can be cached by setting the `cache_ttl` class attribute to the
+    time-to-live of the cache entries, in seconds. Only replies with a 200 status are cached,
+    using the request path and query arguments as the key. Service code modifying the
+    data returned by a cached handler must invalidate the related entries by calling the
+    :py:meth:`invalidate_cache` class method of the handler. Note that in multi-process mode,
+    each worker process has its own cache, and that invalidations only apply to the cache
+    of the process they are made in.
+
+    Handlers with expensive GET requests can set the `coalesce_requests` class attribute to
+    True. Identical requests (same path, query arguments and reply format) received while
+    one of them is being processed then wait for it and share its reply, instead of running
+    `do_get` again (see :py:mod:`pycstbox.webservices.coalescing`). Streamed replies are not
+    shared, and handlers using :py:meth:`stream_reply` should not enable this.
+
+    Handlers able to tell cheaply if the data they would return has changed, for instance
+    using a revision counter, can override :py:meth:`get_version`. A strong ETag derived
+    from the returned token is then added to the GET replies, and requests with a matching
+    `If-None-Match` header are answered with a 304 status without running `do_get` at all.
+
+    Large result sets can be sent progressively with :py:meth:`stream_reply`, instead of
+    being built in memory before being written.
+
+    Dictionaries passed to :py:meth:`write` are encoded in JSON, or in MessagePack if the
+    client asks for it in the `Accept` header. Columns of numbers, such as time series, can
+    be written with :py:meth:`write_columns`, which adds the binary columnar format to the
+    choice (see :py:mod:`pycstbox.webservices.formats`). Cached replies are stored per format.
+
+    If the server compresses the replies, handlers can opt out by setting the
+    `compress_reply` class attribute to False. Compressed forms of cached replies are
+    stored with them, so that they are compressed only once.
+
+    Requests are subject to the server and services admission control (see
+    :py:mod:`pycstbox.webservices.admission`), and rejected with a 429 or 503 status
+    before reaching the handler method when a limit is exceeded. Handlers which must always
+    be reachable, such as monitoring ones, can opt out by setting the `admission_control`
+    class attribute to False.
+
+    If the server is configured for, requests can be profiled on demand (see
+    :py:mod:`pycstbox.webservices.profiling`).
+    """
 
     _logger = None
 
+    # time-to-live of the cached GET replies, in seconds (no caching if None)
+    cache_ttl = None
+    # the cache shared by all handlers
+    response_cache = ResponseCache()
+    # headers which are not stored with the cached and the shared replies
+    _UNCACHED_HEADERS = frozenset((
+        'Date', 'Server', 'Content-Length', 'Transfer-Encoding', 'Etag', 'Connection', profiling.PROFILE_ID_HEADER
+    ))
+
+    # set to True to share the reply of a GET request with the identical ones received meanwhile
+    coalesce_requests = False
+    # the computations in progress of all handlers
+    single_flight = SingleFlight()
+
+    # set to False to disable the replies compression for this handler
+    compress_reply = True
+
+    # set to False to exempt this handler from the admission control
+    admission_control = True
+
+    # set to False to ignore the profiling requests for this handler
+    profile_requests = True
+
+    _cache_key = None
+    _flight_key = None
+    _shared_reply = None
+    _reply_formats = None
+    _route = None
+    _admitted = False
+    _service_name = None
+
     def initialize(self, logger=None, **kwargs): #pylint: disable=W0221
         if logger:
             self._logger = logger
-            if self.application.settings['debug']:
+            # the level is set once, since setLevel is not free (it clears the loggers cache
+            # in recent Python versions)
+            if self.application.settings['debug'] and logger.level != log.DEBUG:
                 self._logger.setLevel(log.DEBUG)
 
+    def prepare(self):
+        self._route = self.application.app_server.get_route_pattern(self) or UNKNOWN_ROUTE
+        self.application.app_server.metrics.enter(self._route)
+        if not self.compress_reply:
+            self._transforms = [t for t in self._transforms if not isinstance(t, CompressionTransform)]
+        if self.application.app_server.draining:
+            # ask keep-alive clients to reconnect, so that they are served by the next process
+            self.set_header('Connection', 'close')
+        if self.admission_control:
+            self._admit()
+
+    def _admit(self):
+        """ Submits the request to the admission control, and replies immediately if it
+        is rejected.
+        """
+        app_server = self.application.app_server
+        self._service_name = app_server.get_service_name(self.request.path)
+        rejection = app_server.admission.admit(self.request.remote_ip, self._service_name)
+        if rejection is None:
+            self._admitted = True
+            return
+
+        status, retry_after = rejection
+        # 429 status is not known by Python 2 httplib
+        self.set_status(status, 'Too Many Requests' if status == 429 else None)
+        self.set_header('Retry-After', str(retry_after))
+        self.write({'message': 'request rate limit exceeded' if status == 429 else 'server overloaded'})
+        self.finish()
+
+    def on_finish(self):
+        # the route is set only if the request has been counted in by prepare
+        if self._route is not None:
+            self.application.app_server.metrics.leave(self._route)
+        if self._admitted:
+            self.application.app_server.admission.release(self._service_name)
+
+    def _start_profiler(self):
+        """ Returns the profiler to be used for the request if it asks for being profiled,
+        or None otherwise.
+        """
+        store = self.application.app_server.profiles
+        if store is None or not self.profile_requests:
+            return None
+        token = self.request.headers.get(profiling.PROFILE_HEADER) or self.get_query_argument(
+            profiling.PROFILE_ARGUMENT, None
+        )
+        if token is None:
+            return None
+        if not store.is_authorized(token):
+            raise tornado.web.HTTPError(403, 'invalid profiling token')
+        profiler = store.start()
+        if profiler is None and self._logger:
+            self._logger.warning('profiling already in progress => request not profiled')
+        return profiler
+
+    def _save_profile(self, profiler, method):
+        record_id = self.application.app_server.profiles.save(profiler, {
+            'method': self.request.method,
+            'uri': profiling.redact_uri(self.request.uri),
+            'handler': '%s.%s' % (self.__class__.__name__, method.__name__),
+            'duration': self.request.request_time()
+        })
+        if not self._headers_written:
+            self.set_header(profiling.PROFILE_ID_HEADER, record_id)
+
+    @gen.coroutine
     def _process_request(self, method, *args, **kwargs):
+        profiler = None
         try:
-            method(*args, **kwargs)
+            profiler = self._start_profiler()
+            executor = None
+            if getattr(method, 'blocking', False):
+                executor = self.application.app_server.get_service_executor(self.request.path)
+            if executor:
+                try:
+                    if profiler:
+                        result = executor.submit(profiler.runcall, method, *args, **kwargs)
+                    else:
+                        result = executor.submit(method, *args, **kwargs)
+                except ServiceBusy:
+                    raise tornado.web.HTTPError(503, 'too many pending requests for this service')
+            else:
+                if profiler:
+                    profiler.enable()
+                monitor = self.application.app_server.loop_monitor
+                if monitor:
+                    monitor.begin(self._route)
+                try:
+                    result = method(*args, **kwargs)
+                finally:
+                    if monitor:
+                        monitor.end()
+            if gen.is_future(result):
+                yield result
+            if profiler:
+                self._save_profile(profiler, method)
+                profiler = None
+            if self._cache_key is not None:
+                self._cache_reply()
+            if self._flight_key is not None:
+                self._share_reply()
         except Exception as e:
+            if profiler:
+                self._save_profile(profiler, method)
             if self._logger:
                 self._logger.exception(e)
-            if isinstance(e, tornado.web.HTTPError):
+            if self._headers_written:
+                # a part of the reply has already been sent (streamed replies), so that the
+                # error cannot be reported. Abort the connection to signal the truncated reply.
+                self.request.connection.close()
+            elif isinstance(e, tornado.web.HTTPError):
+                # the coalesced requests fail the same way
+                self._shared_reply = e
                 raise
             else:
                 self.exception_reply(e)
+                if self._flight_key is not None:
+                    self._share_reply()
         else:
             # force a write of the reply now, to avoid some clients considering they are stalled,
             # (tolerate request no more opened situation)
@@ -69,31 +327,249 @@ class WSHandler(tornado.web.RequestHandler):
             except RuntimeError:
                 # request was already finished
                 pass
+        finally:
+            if self._flight_key is not None:
+                self.single_flight.land(self.__class__, self._flight_key, self._shared_reply)
 
     def get(self, *args, **kwargs):
-        self._process_request(self.do_get, *args, **kwargs)
+        version = self.get_version(*args, **kwargs)
+        if version is not None:
+            self.set_header('Etag', '"%s"' % hashlib.sha1(
+                '%s|%s|%s|%s' % (self.__class__.__name__, self.request.uri, version, self.get_reply_formats())
+            ).hexdigest())
+            if self.check_etag_header():
+                self.set_status(304)
+                return
+
+        if self.cache_ttl or self.coalesce_requests:
+            key = (
+                self.request.path,
+                tuple(sorted((name, tuple(values)) for name, values in self.request.query_arguments.items())),
+                self.get_reply_formats()
+            )
+            if self.cache_ttl:
+                self._cache_key = key
+                cached = self.response_cache.get(self.__class__, key)
+                if cached:
+                    self._write_cached_reply(cached)
+                    return
+            # profiled requests are processed on their own
+            if self.coalesce_requests and profiling.PROFILE_HEADER not in self.request.headers:
+                flight = self.single_flight.join(self.__class__, key)
+                if flight is not None:
+                    return self._follow(flight, *args, **kwargs)
+                self._flight_key = key
+        return self._process_request(self.do_get, *args, **kwargs)
+
+    @gen.coroutine
+    def _follow(self, flight, *args, **kwargs):
+        """ Waits for the identical request in progress, and replies with its result."""
+        reply = yield flight
+        if isinstance(reply, Exception):
+            raise reply
+        if reply is None:
+            # the reply could not be shared (streamed one for instance)
+            yield self._process_request(self.do_get, *args, **kwargs)
+        else:
+            self._write_cached_reply(reply)
+
+    def get_version(self, *args, **kwargs):   #pylint: disable=W0613
+        """ Returns the version token of the data returned by GET requests.
+
+        The token can be any value which string representation changes each time the
+        reply to the request would change. It is invoked with the same arguments as
+        `do_get`, and must be fast since it is called for each request.
+
+        The default implementation returns None, which disables the ETag support.
+        """
+        return None
 
     def do_get(self, *args, **kwargs):
         self.reply_not_implemented()
 
     def post(self, *args, **kwargs):
-        self._process_request(self.do_post, *args, **kwargs)
+        return self._process_request(self.do_post, *args, **kwargs)
 
     def do_post(self, *args, **kwargs):
         self.reply_not_implemented()
 
     def put(self, *args, **kwargs):
-        self._process_request(self.do_put, *args, **kwargs)
+        return self._process_request(self.do_put, *args, **kwargs)
 
     def do_put(self, *args, **kwargs):
         self.reply_not_implemented()
 
     def delete(self, *args, **kwargs):
-        self._process_request(self.do_delete, *args, **kwargs)
+        return self._process_request(self.do_delete, *args, **kwargs)
 
     def do_delete(self, *args, **kwargs):
         self.reply_not_implemented()
 
+    def _reply_headers(self):
+        return [(n, v) for n, v in self._headers.get_all() if n not in self._UNCACHED_HEADERS]
+
+    def _cache_reply(self):
+        """ Stores the reply being built in the cache, if it is a successful one."""
+        if self.get_status() != 200 or self._finished or self._headers_written:
+            return
+        self.response_cache.put(
+            self.__class__, self._cache_key, 200, self._reply_headers(), b''.join(self._write_buffer), self.cache_ttl
+        )
+
+    def _share_reply(self):
+        """ Keeps the reply being built for the requests coalesced with this one."""
+        if self._finished or self._headers_written:
+            return
+        self._shared_reply = CachedReply(
+            self.get_status(), self._reply_headers(), b''.join(self._write_buffer), None, 0, {}
+        )
+
+    def _write_cached_reply(self, cached):
+        self.set_status(cached.status)
+        for name in set(n for n, _ in cached.headers):
+            self.clear_header(name)
+        for name, value in cached.headers:
+            self.add_header(name, value)
+
+        body = cached.body
+        compression = self.application.app_server.compression
+        if (compression and self.compress_reply and len(body) >= compression.min_size and
+                compression.is_compressible(self._headers.get('Content-Type', ''))):
+            encoding = compression.negotiate(self.request.headers.get('Accept-Encoding', ''))
+            if encoding:
+                compressed = cached.variants.get(encoding)
+                if compressed is None:
+                    compressed = compression.compress(body, encoding)
+                    if self._cache_key is not None:
+                        self.response_cache.add_variant(self.__class__, self._cache_key, encoding, compressed)
+                    else:
+                        # shared reply of coalesced requests
+                        cached.variants[encoding] = compressed
+                self.set_header('Content-Encoding', encoding)
+                body = compressed
+        self.write(body)
+
+    @classmethod
+    def invalidate_cache(cls, path=None):
+        """ Invalidates the cached replies produced by this handler class.
+
+        In multi-process mode, only the cache of the current worker process is affected,
+        the other workers serving their cached replies until they expire.
+
+        :Parameters:
+            path : str
+                if provided, only the replies for this request path are invalidated
+
+        :returns: the number of invalidated entries
+        """
+        return cls.response_cache.invalidate(tag=cls, path=path)
+
+    def get_reply_formats(self):
+        """ Returns the formats negotiated with the client for the documents and for the
+        columns replies, as a tuple.
+        """
+        if self._reply_formats is None:
+            accept = self.request.headers.get('Accept', '')
+            self._reply_formats = (
+                formats.negotiate(accept, formats.DOCUMENT_FORMATS),
+                formats.negotiate(accept, formats.COLUMNS_FORMATS)
+            )
+        return self._reply_formats
+
+    def write(self, chunk):
+        """ Overridden version of `write`, encoding dictionaries in the format negotiated
+        with the client (JSON by default).
+        """
+        if isinstance(chunk, dict):
+            if self.get_reply_formats()[0] == formats.MSGPACK:
+                chunk = formats.encode_msgpack(chunk)
+                self.set_header("Content-Type", formats.MSGPACK)
+            else:
+                chunk = self.application.app_server.json_encoder.encode(chunk)
+                self.set_header("Content-Type", "application/json; charset=UTF-8")
+            self.set_header("Vary", "Accept")
+        super(WSHandler, self).write(chunk)
+
+    def write_columns(self, columns):
+        """ Writes a reply made of columns of numbers, for instance the timestamps and the
+        values of a time series.
+
+        The columns are sent in the binary columnar format if the client asks for it,
+        directly from the buffers of the arrays. Otherwise they are sent as a dictionary
+        of lists, in the negotiated format.
+
+        :Parameters:
+            columns : list
+                the (name, values) pairs of the columns, the values being `array.array`
+                or 1-D NumPy arrays. An ordered dictionary can be used instead.
+        """
+        if isinstance(columns, dict):
+            columns = columns.items()
+        if self.get_reply_formats()[1] == formats.COLUMNS:
+            self.set_header("Content-Type", formats.COLUMNS)
+            self.set_header("Vary", "Accept")
+            super(WSHandler, self).write(formats.encode_columns(columns))
+        else:
+            self.write(formats.columns_as_dict(columns))
+
+    @gen.coroutine
+    def stream_reply(self, items, ndjson=False, chunk_size=STREAM_CHUNK_SIZE):
+        """ Sends a sequence of items progressively, as a JSON array or as newline
+        delimited JSON records.
+
+        Items are encoded and sent by chunks, the next ones being produced only when the
+        previous chunk has been written to the connection. The memory used is thus
+        independent of the number of items.
+
+        This method is a coroutine, and must be yielded by the calling `do_xxx` method.
+
+        :Parameters:
+            items : iterable
+                the items to be sent. It can be a generator, and items can be futures,
+                which are waited for (for instance when they are fetched asynchronously).
+            ndjson : bool
+                if True, the reply is sent as NDJSON (one JSON record per line). Otherwise
+                it is a JSON array.
+            chunk_size : int
+                the amount of encoded data sent at once
+        """
+        # records are never pretty printed, since NDJSON requires one record per line
+        encode = self.application.app_server.stream_encoder.encode
+        if ndjson:
+            self.set_header("Content-Type", "application/x-ndjson")
+            separator, closing = '', ''
+        else:
+            self.set_header("Content-Type", "application/json; charset=UTF-8")
+            separator, closing = ',', ']'
+            self.write('[')
+
+        batch = []
+        pending = 0
+        first = True
+        for item in items:
+            if gen.is_future(item):
+                item = yield item
+            data = encode(item)
+            if ndjson:
+                data += '\n'
+            elif not first:
+                data = separator + data
+            first = False
+            batch.append(data)
+
+            pending += len(data)
+            if pending >= chunk_size:
+                self.write(''.join(batch))
+                batch, pending = [], 0
+                # wait for the data being actually sent before producing more, and give
+                # the hand back to the loop, since the flush future is already resolved
+                # when the data fits in the socket buffers
+                yield self.flush()
+                yield gen.moment
+
+        batch.append(closing)
+        self.write(''.join(batch))
+
     def write_error(self, status_code, exc_info=None, **kwargs):
         """ Overridden version of error reporting, returning the reply as JSON data.
         """
@@ -150,20 +626,195 @@ class ServiceDescriptor(namedtuple('ServiceDescriptor', 'name label handlers')):
     """
 
 
+class ServicesRouter(tornado.routing.Router):
+    """ Dispatches the requests to the rules of the service they are addressed to.
+
+    The service is identified by the first path segment following the application URL base,
+    and is looked up in a dictionary. Only the rules of this service are then tried in turn.
+    This avoids scanning the rules of all the services for each request.
+
+    Requests not addressed to a known service, or not matching any of its rules, are
+    left to the next rules of the application.
+
+    Note that the names given to service rules are ignored, so that reversing their URL
+    with `reverse_url` is not supported.
+
+    Rules with no handler are placeholders for services not loaded yet. The first request
+    matching one of them triggers the loading of the service by the provided loader. The
+    requests received until it completes wait for it, without blocking the server loop.
+    """
+    def __init__(self, url_base, services, loader=None):
+        """
+        :Parameters:
+            url_base : str
+                the application URL base
+            services : list of ServiceDescriptor
+                the services
+            loader : callable
+                the function starting the loading of a service not loaded yet, given its name.
+                It returns a future resolving to the service rules, or to None if the
+                loading failed.
+        """
+        self.application = None
+        self._prefix = url_base.rstrip('/') + '/'
+        self._loader = loader
+        # loadings in progress, by service name
+        self._loading = {}
+        self._rules = dict((service.name, self._compile(service.handlers)) for service in services)
+
+    @staticmethod
+    def _compile(handlers):
+        return [
+            (tornado.routing.PathMatches(rule[0]), rule[1], rule[2] if len(rule) > 2 else None)
+            for rule in handlers
+        ]
+
+    def get_service_name(self, path):
+        """ Returns the name of the service a request path is addressed to, or None
+        if it is not a service path.
+        """
+        if not path.startswith(self._prefix):
+            return None
+        return path[len(self._prefix):].split('/', 1)[0]
+
+    def find_handler(self, request, **kwargs):
+        service_name = self.get_service_name(request.path)
+        for matcher, handler_class, handler_kwargs in self._rules.get(service_name, ()):
+            params = matcher.match(request)
+            if params is not None:
+                if handler_class is None:
+                    return _PendingServiceDelegate(self.application, request, self._load_service(service_name))
+                return self.application.get_handler_delegate(request, handler_class, handler_kwargs, **params)
+        return None
+
+    def _load_service(self, service_name):
+        future = self._loading.get(service_name)
+        if future is None:
+            future = self._loading[service_name] = self._loader(service_name)
+            future.add_done_callback(functools.partial(self._service_loaded, service_name))
+        return future
+
+    def _service_loaded(self, service_name, future):
+        del self._loading[service_name]
+        handlers = future.result()
+        if handlers is None:
+            # the service is not available
+            self._rules[service_name] = [
+                (matcher, tornado.web.ErrorHandler, {'status_code': 503})
+                for matcher, _, _ in self._rules[service_name]
+            ]
+        else:
+            self._rules[service_name] = self._compile(handlers)
+
+
+class _PendingServiceDelegate(tornado.httputil.HTTPMessageDelegate):
+    """ Delegate of the requests addressed to a service being loaded.
+
+    The request is dispatched again by the application once the service is loaded, the
+    connection not reading its body until then.
+    """
+    def __init__(self, application, request, loading):
+        self._application = application
+        self._request = request
+        self._loading = loading
+        self._delegate = None
+
+    @gen.coroutine
+    def _resolve(self):
+        yield self._loading
+        self._delegate = self._application.find_handler(self._request)
+
+    @gen.coroutine
+    def headers_received(self, start_line, headers):
+        yield self._resolve()
+        result = self._delegate.headers_received(start_line, headers)
+        if result is not None:
+            yield result
+
+    def data_received(self, chunk):
+        return self._delegate.data_received(chunk)
+
+    def finish(self):
+        self._delegate.finish()
+
+    def on_connection_close(self):
+        if self._delegate is not None:
+            self._delegate.on_connection_close()
+
+    @gen.coroutine
+    def execute(self):
+        """ Used for the internal requests (see :py:mod:`pycstbox.webservices.internal`)."""
+        yield self._resolve()
+        result = self._delegate.execute()
+        if result is not None:
+            yield result
+
+
 class AppServer(object):
     """ Implements the application server, including installed services automatic discovery.
+
+    On SIGTERM, the server stops accepting new connections, and terminates once the requests
+    in progress are completed or after the drain timeout. On SIGHUP, a new server process
+    is started with the same command line, taking over the listening sockets so that
+    no connection is refused. It stops the current process as described above once ready.
+    Since the new process has a different pid, it rewrites the pid file when one is
+    configured, so that the tools supervising the server target the running process.
     """
     APP_NAME = "wsapi"
 
     _logger = None
     _services_home = os.path.join(_here, "services")
 
-    def __init__(self, url_base="/api/", port=8888, debug=False):
+    # maximum number of worker processes restarts in multi-process mode
+    MAX_WORKER_RESTARTS = 100
+
+    def __init__(self, url_base="/api/", port=8888, debug=False, executor_workers=None, processes=1,
+                 cache_max_size=None, json_backend=None, lazy=False,
+                 init_timeout=30., init_workers=DEFAULT_MAX_WORKERS,
+                 compression=False, compression_min_size=COMPRESSION_MIN_SIZE, compression_level=COMPRESSION_LEVEL,
+                 rate_limit=None, rate_burst=None, max_in_flight=None, access_log_sampling=1,
+                 drain_timeout=10., http_client_options=None, data_store_path=None,
+                 loop_lag_threshold=LOOP_LAG_THRESHOLD, pid_file=None):
         """ Constructor
 
         :Parameters:
             port : int
                 the port the server will listen to (default: 8888)
+            processes : int
+                the number of worker processes serving the requests. If greater than 1,
+                the listening socket is bound by the main process which then forks the workers
+                and restarts them if they die. If 0, one worker per CPU is started.
+                (default: 1, i.e. the requests are served by the main process itself)
+            executor_workers : int
+                the number of threads of the pool used to run blocking handlers. If not
+                provided, it is set to the total of the slots required by the services.
+            rate_limit : float
+                the number of requests per second allowed for each client (default: no limit)
+            rate_burst : int
+                the number of requests a client can send at once (default: rate_limit)
+            max_in_flight : int
+                the maximum number of requests processed at the same time, beyond which requests
+                are rejected with a 503 status (default: no limit)
+            access_log_sampling : int
+                only one out of this number of successful requests is logged for each route
+                (default: 1, i.e. all requests are logged)
+            drain_timeout : float
+                the maximum time given to the requests in progress to complete when the server
+                is stopped, in seconds (default: 10)
+            http_client_options : dict
+                the options of the HTTP client shared by the services (see
+                :py:class:`pycstbox.webservices.upstream.UpstreamClient`)
+            data_store_path : str
+                the path of the shared memory store of the variables latest values (see
+                :py:mod:`pycstbox.webservices.hotstore`). If provided, the values are returned
+                by the `/latest` endpoint.
+            loop_lag_threshold : float
+                the time the server loop can be blocked before the stall is recorded, in
+                seconds (see :py:mod:`pycstbox.webservices.loopmonitor`). The loop monitoring
+                is disabled if 0 or None. (default: 0.1)
+            pid_file : str
+                the path of the file in which the pid of the server process is written once
+                started, including after a handover on SIGHUP (default: none)
         """
         self._app_url_base = url_base
         self._port = port
@@ -171,6 +822,58 @@ class AppServer(object):
         self._logger = log.getLogger(self.APP_NAME)
         self._services = None
         self._ioloop = None
+        self._executor_workers = executor_workers
+        self._executor_pool = None
+        self._executors_settings = {}
+        self._service_executors = {}
+        self._processes = tornado.process.cpu_count() if processes == 0 else processes
+        self._deferred_inits = []
+        self._workers = {}
+        self._stopping = False
+        self._drain_timeout = drain_timeout
+        self._pid_file = pid_file
+        self.draining = False
+        self._sockets = None
+        self._http_server = None
+        if cache_max_size is not None:
+            WSHandler.response_cache.max_size = cache_max_size
+        # replies are pretty printed in debug mode
+        self.json_encoder = JSONEncoder(pretty=debug, backend=json_backend)
+        self._logger.info("JSON encoding backend : %s", self.json_encoder.backend)
+        self.stream_encoder = JSONEncoder(backend=json_backend) if debug else self.json_encoder
+        push.hub.encoder = self.json_encoder
+        self.metrics = RequestMetrics()
+        self.profiles = None
+        self._http_client_options = http_client_options
+        self.http_client = UpstreamClient(**(http_client_options or {}))
+        self._json_backend = json_backend
+        self._cache_max_size = cache_max_size
+        self._service_processes = {}
+        # the service served by this process, when run as the child process of an isolated service
+        self._isolated_service = None
+        self._data_store_path = data_store_path
+        self._data_store = None
+        self._loop_lag_threshold = loop_lag_threshold
+        self.loop_monitor = None
+        self._access_log_sampling = access_log_sampling
+        self._access_log = None
+        self.admission = AdmissionControl(rate_limit, rate_burst, max_in_flight)
+        self._route_patterns = {}
+        self._services_router = None
+        self._lazy = lazy
+        self._lazy_loaders = {}
+        self._lazy_failures = {}
+        self._load_times = {}
+        self._init_timeout = init_timeout
+        self._init_workers = init_workers
+        self._pending_inits = []
+        self._init_times = {}
+        if compression:
+            self.compression = Compression(min_size=compression_min_size, level=compression_level)
+            self._logger.info("replies compression enabled with encodings : %s",
+                              ', '.join(self.compression.encodings))
+        else:
+            self.compression = None
 
         if self._debug:
             self._logger.setLevel(log.DEBUG)
@@ -239,13 +942,72 @@ class AppServer(object):
         services. This way, there will be no problem when importing the service
         module in contexts other than standard runtime, for instance during
         unit tests or automatic documentation generation.
-        The `_init_` function is called when the module is imported during the discovery process,
-        but since the order is undefined, its logic cannot rely on what is done in other
-        service plugins.
+        The `_init_` function is called once all the modules have been imported during the
+        discovery process. The `_init_` functions of the different services are run concurrently
+        in separate threads, and thus their logic cannot rely on what is done in other
+        service plugins. Each one must complete within the time given by the `init_timeout`
+        key of the `service` section of the manifest (in seconds), or by the server default
+        timeout if not specified. Services which `_init_` function fails or does not
+        complete in time are disabled.
         It has two keyword parameters :
             - logger : used to pass the owner service logger if defined
             - settings : used to pass the dictionary containing the content of the manifest
             "settings" section if any
+        If it also accepts an `http_client` parameter, the HTTP client shared by the services
+        (a :py:class:`pycstbox.webservices.upstream.UpstreamClient`) is passed in it. Services
+        calling other daemons or devices over HTTP should use it instead of blocking calls.
+
+        When the server runs in multi-process mode, the `init` key of the `service` section
+        of the manifest specifies when the `_init_` function is called :
+            - before_fork (default) : during the discovery, in the main process. Resources
+            created at this time are shared by all the workers, which is fine for immutable data
+            but not for threads, sockets or connections to other services.
+            - after_fork : in each worker process, once it is started. This is the one to be
+            used if the service holds connections or threads.
+        If the `_init_` function fails in this later case, the service is disabled in the
+        involved worker.
+        In single process mode, both options are equivalent.
+
+        To shorten the server startup, services can be loaded lazily, i.e. when receiving their
+        first request. This requires their routes to be declared in the `routes` key of the
+        `service` section, as a whitespace separated list of the URL patterns found in the
+        module route table. Lazy loading is used for such services if the `lazy` option is
+        set when creating the server, unless the `lazy` key of the `service` section
+        is set to `false`. Conversely, setting this key to `true` enables the lazy
+        loading for the service whatever the server option is.
+        Lazily loaded services are imported and initialized in a background thread, within
+        the `init_timeout` limit, the requests received in the meantime waiting for it.
+        Since this happens in the workers in multi-process mode, services explicitly asking
+        for a `before_fork` initialization are never loaded lazily.
+
+        The following keys of the `settings` section are reserved for configuring
+        how the framework runs the service handlers :
+            - executor_slots : if set to a positive number, enables the executor mode,
+            in which handler methods decorated by `blocking` are run in the server
+            thread pool. The value gives the maximum number of calls of the service
+            running concurrently in the pool.
+            - executor_queue : the maximum number of calls waiting for a free slot,
+            beyond which requests are rejected with a 503 error (default: 16)
+            - push_queue : the maximum number of events pending for a client of the service
+            push channel (default: 100)
+            - push_policy : what to do when the queue of a push client is full, `drop` or
+            `coalesce` (default: drop). See :py:mod:`pycstbox.webservices.push`.
+            - rate_limit, rate_burst : the number of requests per second allowed for each client
+            of the service, and the number of requests it can send at once (default: no limit)
+            - max_in_flight : the maximum number of requests of the service processed
+            at the same time (default: no limit)
+
+        A service can be hosted in a dedicated child process by setting the `isolated` key of
+        the `service` section to `true`, so that a memory leak or a CPU hog in its code does not
+        slow down the other services. It is then not imported by the server, which forwards its
+        requests to the child process, and restarts it if it dies. The `memory_limit` key gives
+        the resident memory budget of the process, in MB, beyond which it is replaced by a new
+        one (default: no limit). See :py:mod:`pycstbox.webservices.isolation` for details.
+
+        Each service has a push channel, on which it can publish events with
+        :py:func:`pycstbox.webservices.push.publish`, using its name as the channel name.
+        Clients subscribe to it by connecting a WebSocket to `<url base>/<service>/_push/ws` or
+        by requesting a Server-Sent Events stream at `<url base>/<service>/_push/events`.
 
         Parameters:
             home : src
@@ -265,6 +1027,8 @@ class AppServer(object):
         # then sorted by service names.
         marker_files = {MANIFEST_FILE_NAME, '__init__.py'}
         for service_name in sorted([d for d in os.listdir(home) if os.path.isdir(os.path.join(home, d))]):
+            if self._isolated_service and service_name != self._isolated_service:
+                continue
             service_path = os.path.join(home, service_name)
             # next filtering could have been done in a more Pythonic way inside for loop definition,
             # but doing this explicitly provides more information in the logs in case of trouble
@@ -280,42 +1044,87 @@ class AppServer(object):
             label = mf.get(MANIFEST_MAIN_SECTION, 'label')
             mapping_attr = mf.get(MANIFEST_MAIN_SECTION, 'mapping')
 
-            module_name = '.'.join([SERVICES_PACKAGE_NAME, service_name])
-            self._logger.info("... loading service '%s' from module '%s'...", service_name, module_name)
+            # load settings if any
             try:
-                module = importlib.import_module(module_name)
-                # run the module initialization code if any
-                if hasattr(module, '_init_'):
-                    init_func = getattr(module, '_init_')
-                    if callable(init_func):
-                        self._logger.info('... invoking module _init_ function...')
-                        svc_logger = self._logger.getChild(service_name)
-                        svc_logger.setLevel(self._logger.getEffectiveLevel())
-
-                        # load settings if any
-                        try:
-                            settings = dict(mf.items(MANIFEST_SETTINGS_SECTION))
-                        except ConfigParser.NoSectionError:
-                            settings = None
-
-                        init_func(logger=svc_logger, settings=settings)
-                        self._logger.info('... module _init_ OK')
-
-                url_base = "%s/%s/" % (self._app_url_base.rstrip('/'), service_name)
-                mapping = getattr(module, mapping_attr)
-                # expand the URL in mappings if needed
-                handlers = []
-                for rule in mapping:
-                    effective_url = url_base + rule[0].lstrip('/')
-                    # check first if the rule is valid as a regexp
-                    try:
-                        re.compile(effective_url)
-                    except re.error as e:
-                        raise Exception('"%s" is an invalid route specification (%s)' % (effective_url, e.message))
-                    else:
-                        handlers.append(((effective_url,) + rule[1:]))
+                settings = dict(mf.items(MANIFEST_SETTINGS_SECTION))
+            except ConfigParser.NoSectionError:
+                settings = None
+
+            init_explicit = mf.has_option(MANIFEST_MAIN_SECTION, MANIFEST_INIT_OPTION)
+            if init_explicit:
+                init_when = mf.get(MANIFEST_MAIN_SECTION, MANIFEST_INIT_OPTION)
+            else:
+                init_when = INIT_BEFORE_FORK
+            if mf.has_option(MANIFEST_MAIN_SECTION, MANIFEST_INIT_TIMEOUT_OPTION):
+                init_timeout = mf.getfloat(MANIFEST_MAIN_SECTION, MANIFEST_INIT_TIMEOUT_OPTION)
+            else:
+                init_timeout = self._init_timeout
+
+            lazy = self._lazy
+            if mf.has_option(MANIFEST_MAIN_SECTION, MANIFEST_LAZY_OPTION):
+                lazy = mf.getboolean(MANIFEST_MAIN_SECTION, MANIFEST_LAZY_OPTION)
+            if lazy and not mf.has_option(MANIFEST_MAIN_SECTION, MANIFEST_ROUTES_OPTION):
+                self._logger.info("... no routes declared in manifest => lazy loading not possible")
+                lazy = False
+            if lazy and init_explicit and init_when == INIT_BEFORE_FORK and self._processes != 1:
+                self._logger.info("... initialization before fork required => lazy loading not possible")
+                lazy = False
+
+            isolated = not self._isolated_service and mf.has_option(MANIFEST_MAIN_SECTION, MANIFEST_ISOLATED_OPTION) \
+                and mf.getboolean(MANIFEST_MAIN_SECTION, MANIFEST_ISOLATED_OPTION)
+
+            start_time = time.time()
+            try:
+                if isolated:
+                    handlers = self._expand_routes(service_name, [(r'.*', self.IsolatedService)])
+                    memory_limit = None
+                    if mf.has_option(MANIFEST_MAIN_SECTION, MANIFEST_MEMORY_LIMIT_OPTION):
+                        memory_limit = int(mf.getfloat(MANIFEST_MAIN_SECTION, MANIFEST_MEMORY_LIMIT_OPTION) * 1024 * 1024)
+                    self._service_processes[service_name] = isolation.ServiceProcess(
+                        service_name, None, self._get_service_logger(service_name),
+                        memory_limit=memory_limit, start_timeout=init_timeout
+                    )
+                    self._logger.info("... service hosted in a dedicated process")
+                elif lazy:
+                    if init_when not in (INIT_BEFORE_FORK, INIT_AFTER_FORK):
+                        raise ValueError('invalid %s option value : %s' % (MANIFEST_INIT_OPTION, init_when))
+                    declared_routes = mf.get(MANIFEST_MAIN_SECTION, MANIFEST_ROUTES_OPTION).split()
+                    handlers = self._expand_routes(service_name, [(route, None) for route in declared_routes])
+                    self._lazy_loaders[service_name] = (
+                        functools.partial(self._load_service, service_name, mapping_attr, settings, None, None),
+                        init_timeout
+                    )
+                    self._logger.info("... service loading deferred until first request")
+                else:
+                    handlers = self._load_service(service_name, mapping_attr, settings, init_when, init_timeout)
+
+                if settings and int(settings.get(SETTING_EXECUTOR_SLOTS, 0)) > 0 and not isolated:
+                    self._executors_settings[service_name] = (
+                        int(settings[SETTING_EXECUTOR_SLOTS]),
+                        int(settings.get(SETTING_EXECUTOR_QUEUE, DEFAULT_QUEUE_SIZE))
+                    )
+                    self._logger.info("... executor mode enabled with (slots, queue)=%s",
+                                      self._executors_settings[service_name])
+                if settings and (SETTING_RATE_LIMIT in settings or SETTING_MAX_IN_FLIGHT in settings):
+                    self.admission.configure_service(
+                        service_name,
+                        float(settings.get(SETTING_RATE_LIMIT, 0)) or None,
+                        int(settings.get(SETTING_RATE_BURST, 0)) or None,
+                        int(settings.get(SETTING_MAX_IN_FLIGHT, 0)) or None
+                    )
+                    self._logger.info("... admission control enabled with (rate, burst, max_in_flight)=%s",
+                                      tuple(settings.get(k) for k in (SETTING_RATE_LIMIT, SETTING_RATE_BURST,
+                                                                      SETTING_MAX_IN_FLIGHT)))
+                if settings and (push.SETTING_PUSH_QUEUE in settings or push.SETTING_PUSH_POLICY in settings):
+                    push.hub.configure(
+                        service_name,
+                        int(settings.get(push.SETTING_PUSH_QUEUE, push.DEFAULT_QUEUE_SIZE)),
+                        settings.get(push.SETTING_PUSH_POLICY, push.POLICY_DROP)
+                    )
+
                 services.append(ServiceDescriptor(service_name, label, handlers))
-                self._logger.info(">>> success")
+                self._load_times[service_name] = time.time() - start_time
+                self._logger.info(">>> success (%.1fms)", 1000. * self._load_times[service_name])
 
             except (ImportError, AttributeError) as e:
                 msg = '[%s] %s' % (e.__class__.__name__, str(e))
@@ -324,7 +1133,236 @@ class AppServer(object):
             except Exception as e:
                 self._logger.exception(e)
                 self._logger.error("*** Could not load service '%s' because of previous exception", service_name)
-        return services
+
+        failed = self._run_inits(self._pending_inits)
+        self._pending_inits = []
+        return [s for s in services if s.name not in failed]
+
+    def _expand_routes(self, service_name, mapping):
+        """ Returns the rules of a service mapping table, with their URL pattern prefixed by
+        the service URL base.
+        """
+        url_base = "%s/%s/" % (self._app_url_base.rstrip('/'), service_name)
+        # expand the URL in mappings if needed
+        handlers = []
+        for rule in mapping:
+            effective_url = url_base + rule[0].lstrip('/')
+            # check first if the rule is valid as a regexp
+            try:
+                re.compile(effective_url)
+            except re.error as e:
+                raise Exception('"%s" is an invalid route specification (%s)' % (effective_url, e.message))
+            else:
+                handlers.append(((effective_url,) + tuple(rule[1:])))
+        return handlers
+
+    def _load_service(self, service_name, mapping_attr, settings, init_when, init_timeout):
+        """ Imports a service module, initializes it and returns its rules.
+
+        :Parameters:
+            service_name : str
+                the name of the service
+            mapping_attr : str
+                the name of the module attribute containing the routes table
+            settings : dict
+                the service settings
+            init_when : str
+                when the `_init_` function of the module must be called. If None, it
+                is called immediately.
+            init_timeout : float
+                the maximum duration of the `_init_` function
+        """
+        module_name = '.'.join([SERVICES_PACKAGE_NAME, service_name])
+        self._logger.info("... loading service '%s' from module '%s'...", service_name, module_name)
+        module = importlib.import_module(module_name)
+        # run the module initialization code if any
+        if hasattr(module, '_init_'):
+            init_func = getattr(module, '_init_')
+            if callable(init_func):
+                if init_when == INIT_AFTER_FORK:
+                    self._logger.info('... module _init_ function deferred after fork')
+                    self._deferred_inits.append((service_name, init_func, settings, init_timeout))
+                elif init_when == INIT_BEFORE_FORK:
+                    self._pending_inits.append((service_name, init_func, settings, init_timeout))
+                elif init_when is None:
+                    self._init_service(service_name, init_func, settings)
+                else:
+                    raise ValueError('invalid %s option value : %s' % (MANIFEST_INIT_OPTION, init_when))
+
+        return self._expand_routes(service_name, getattr(module, mapping_attr))
+
+    def _load_lazy_service(self, service_name):
+        """ Starts loading a service which loading has been deferred until its first request.
+
+        The service module is imported and initialized in a background thread, so that
+        the server loop is not blocked meanwhile.
+
+        :returns: a future resolving to the service rules, or to None if the loading failed
+        """
+        loader, timeout = self._lazy_loaders[service_name]
+        self._logger.info("loading service '%s' on first request...", service_name)
+        future = Future()
+        task = InitTask(service_name, loader, {}, timeout)
+        ioloop = tornado.ioloop.IOLoop.current()
+
+        def run():
+            run_tasks([task], 1)
+            ioloop.add_callback(self._lazy_service_loaded, task, future)
+
+        thread = threading.Thread(target=run, name='load-' + service_name)
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def _lazy_service_loaded(self, task, future):
+        """ Terminates the loading of a lazy service, once its loading task is over."""
+        service_name = task.name
+        if task.timed_out:
+            self._logger.error("*** Service '%s' disabled since its loading did not complete in %.1fs",
+                               service_name, task.timeout)
+            self._lazy_failures[service_name] = 'loading did not complete in %.1fs' % task.timeout
+            future.set_result(None)
+            return
+        if task.error:
+            self._logger.error(task.traceback)
+            self._logger.error("*** Service '%s' disabled because of previous exception", service_name)
+            self._lazy_failures[service_name] = str(task.error)
+            future.set_result(None)
+            return
+
+        del self._lazy_loaders[service_name]
+        handlers = task.result
+        self._load_times[service_name] = task.duration
+        self._logger.info(">>> service '%s' loaded (%.1fms)", service_name, 1000. * task.duration)
+
+        services = []
+        for service in self._services:
+            if service.name == service_name:
+                if set(rule[0] for rule in handlers) != set(rule[0] for rule in service.handlers):
+                    self._logger.warning("routes of service '%s' differ from the ones declared in its manifest",
+                                         service_name)
+                service = ServiceDescriptor(service_name, service.label, handlers)
+            services.append(service)
+        self._services = services
+        self._handlers = self._setup_handlers(services)
+        future.set_result(handlers)
+
+    def get_services_status(self):
+        """ Returns the loading status of the services, as a list of dictionaries."""
+        return [
+            {
+                'name': service.name,
+                'label': service.label,
+                'loaded': service.name not in self._lazy_loaders,
+                'error': self._lazy_failures.get(service.name),
+                'load_time': 1000. * self._load_times[service.name] if service.name in self._load_times else None,
+                'init_time': 1000. * self._init_times[service.name] if service.name in self._init_times else None,
+                'process': (
+                    self._service_processes[service.name].status() if service.name in self._service_processes else None
+                )
+            }
+            for service in self.services
+        ]
+
+    def get_data_store(self):
+        """ Returns the shared store of the variables latest values, or None if not
+        configured or not created yet by the processes writing it.
+        """
+        if self._data_store is None and self._data_store_path and os.path.exists(self._data_store_path):
+            try:
+                self._data_store = HotStore(self._data_store_path)
+            except HotStoreError as e:
+                self._logger.error("cannot open data store (%s)", e)
+        return self._data_store
+
+    def get_service_process(self, service_name):
+        """ Returns the manager of the process hosting a service, or None if the service
+        is not isolated.
+        """
+        return self._service_processes.get(service_name)
+
+    def get_service_processes(self):
+        """ Returns the managers of the processes hosting the isolated services, by service name."""
+        return dict(self._service_processes)
+
+    def get_connections_count(self):
+        """ Returns the number of open client connections of this process."""
+        if self._http_server is None:
+            return 0
+        return len(self._http_server._connections)  #pylint: disable=W0212
+
+    def has_service(self, service_name):
+        """ Tells if a service is available, whether it is loaded or not."""
+        return any(service.name == service_name for service in self.services)
+
+    def _get_service_logger(self, service_name):
+        svc_logger = self._logger.getChild(service_name)
+        svc_logger.setLevel(self._logger.getEffectiveLevel())
+        return svc_logger
+
+    def _init_kwargs(self, service_name, init_func, settings):
+        """ Returns the keyword parameters of the call of a service `_init_` function."""
+        kwargs = {'logger': self._get_service_logger(service_name), 'settings': settings}
+        try:
+            argspec = inspect.getargspec(init_func)
+        except TypeError:
+            # not a plain function
+            return kwargs
+        if argspec.keywords or 'http_client' in argspec.args:
+            kwargs['http_client'] = self.http_client
+        return kwargs
+
+    def _init_service(self, service_name, init_func, settings):
+        """ Invokes the `_init_` function of a service module."""
+        self._logger.info('... invoking module _init_ function...')
+        start_time = time.time()
+        init_func(**self._init_kwargs(service_name, init_func, settings))
+        self._init_times[service_name] = time.time() - start_time
+        self._logger.info('... module _init_ OK')
+
+    def _run_inits(self, inits):
+        """ Runs services `_init_` functions concurrently.
+
+        :Parameters:
+            inits : list
+                a list of (service name, init function, settings, timeout) tuples
+
+        :returns: the set of the names of the services which initialization failed
+        """
+        if not inits:
+            return set()
+
+        tasks = [
+            InitTask(service_name, init_func, self._init_kwargs(service_name, init_func, settings), timeout)
+            for service_name, init_func, settings, timeout in inits
+        ]
+        self._logger.info("running %d services _init_ functions...", len(tasks))
+        run_tasks(tasks, self._init_workers)
+
+        failed = set()
+        for task in tasks:
+            if task.timed_out:
+                self._logger.error("*** Service '%s' disabled since its _init_ did not complete in %.1fs",
+                                   task.name, task.timeout)
+            elif task.error:
+                self._logger.error(task.traceback)
+                self._logger.error("*** Service '%s' disabled because of previous exception", task.name)
+            else:
+                self._init_times[task.name] = task.duration
+                self._logger.info("... service '%s' _init_ OK (%.1fms)", task.name, 1000. * task.duration)
+                continue
+            failed.add(task.name)
+            self._executors_settings.pop(task.name, None)
+        return failed
+
+    def _run_deferred_inits(self):
+        """ Invokes the `_init_` functions of services which asked for being initialized
+        after the fork, disabling the services for which it fails.
+        """
+        failed = self._run_inits(self._deferred_inits)
+        self._deferred_inits = []
+        if failed:
+            self._services = [s for s in self._services if s.name not in failed]
 
     class InvalidRequest(WSHandler):
         def do_get(self, *args, **kwargs):
@@ -333,20 +1371,114 @@ class AppServer(object):
         def do_post(self, *args, **kwargs):
             self.do_get()
 
+    class Metrics(WSHandler):
+        """ Reports the requests metrics, as JSON data or in Prometheus text format. The later is
+        returned if the `format` argument is set to `prometheus`, or if the `Accept` header asks
+        for plain text.
+
+        The JSON data include the admission control and the requests coalescing statistics.
+        """
+        disable_request_logging = True
+        admission_control = False
+
+        def do_get(self, *args, **kwargs):
+            metrics = self.application.app_server.metrics
+            fmt = self.get_argument('format', None)
+            if fmt is None:
+                accept = self.request.headers.get('Accept', '')
+                fmt = 'prometheus' if 'text/plain' in accept or 'openmetrics' in accept else 'json'
+            if fmt == 'prometheus':
+                self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.write(metrics.as_prometheus())
+            else:
+                data = metrics.as_dict()
+                data['admission'] = self.application.app_server.admission.stats()
+                data['coalescing'] = WSHandler.single_flight.stats()
+                self.write(data)
+
+    class LatestValues(WSHandler):
+        """ Returns the latest values of variables, read from the shared data store, as a
+        dictionary of [value, timestamp] lists keyed by the variables names.
+
+        The returned variables can be selected by their names, given as a comma separated list
+        in the `names` argument, or by a prefix given in the `prefix` argument. All the variables
+        are returned otherwise.
+        """
+        def do_get(self, *args, **kwargs):
+            store = self.application.app_server.get_data_store()
+            if store is None:
+                raise tornado.web.HTTPError(503, 'data store not available')
+
+            names = self.get_argument('names', None)
+            items = store.items(names.split(',') if names else None)
+            prefix = self.get_argument('prefix', None)
+            if prefix:
+                items = [item for item in items if item[0].startswith(prefix)]
+            self.write({'values': dict((name, [value, timestamp]) for name, value, timestamp in items)})
+
+    class IsolatedService(WSHandler):
+        """ Forwards the requests of a service to the child process hosting it.
+        """
+        # the requests are profiled by the child process
+        profile_requests = False
+
+        @gen.coroutine
+        def _forward(self, *args, **kwargs):  #pylint: disable=W0613
+            app_server = self.application.app_server
+            process = app_server.get_service_process(app_server.get_service_name(self.request.path))
+            request = self.request
+            try:
+                status, reason, headers, body = yield process.fetch(
+                    request.method, request.uri, request.headers, request.body, request.remote_ip, request.protocol
+                )
+            except isolation.ServiceUnavailable as e:
+                self.set_status(503)
+                self.set_header('Retry-After', '1')
+                self.write({'message': str(e)})
+                return
+            except gen.TimeoutError:
+                raise tornado.web.HTTPError(504, 'service process timeout')
+
+            self.set_status(status, reason)
+            for name in set(n for n, _ in headers):
+                self.clear_header(name)
+            for name, value in headers:
+                self.add_header(name, value)
+            if body:
+                self.write(body)
+
+        do_get = do_post = do_put = do_delete = _forward
+
     # built-in handlers
     toplevel_handlers = [
+        (r"/metrics", Metrics),
     ]
 
     fallback_handlers = [
         (r"/.*", InvalidRequest),
     ]
 
+    def _push_handlers(self):
+        """ Returns the rules of the services push channels endpoints."""
+        url_base = self._app_url_base.rstrip('/')
+        return [
+            (url_base + r"/([^/]+)/_push/ws", push.PushWebSocketHandler),
+            (url_base + r"/([^/]+)/_push/events", push.PushEventsHandler),
+        ]
+
+    def _data_store_handlers(self):
+        """ Returns the rules of the data store endpoint, if the store is configured."""
+        if not self._data_store_path:
+            return []
+        return [(r"/latest", self.LatestValues)]
+
     def _setup_handlers(self, services):
         """ Build the effective request handlers list.
 
         The following logic is used :
             - initialize the list with the content of toplevel_handlers
-            attribute
+            attribute, the rules of the push channels endpoints and the one of the
+            data store endpoint if configured
             - for each discovered service:
                 - add the rules for the service
             - add the rules defined in fallback_handlers attribute
@@ -355,13 +1487,24 @@ class AppServer(object):
 
         """
 
-        handlers = self.toplevel_handlers
+        handlers = list(self.toplevel_handlers) + self._push_handlers() + self._data_store_handlers()
 
         for service in services:
             handlers.extend(service.handlers)
 
         handlers.extend(self.fallback_handlers)
 
+        self._route_patterns = {}
+        for rule in handlers:
+            pattern, handler = rule[:2]
+            if handler is None:
+                # service not loaded yet
+                continue
+            self._route_patterns.setdefault(handler, []).append(
+                # Tornado anchors the patterns at both ends
+                (re.compile(pattern if pattern.endswith('$') else pattern + '$'), pattern)
+            )
+
         if self._logger.isEnabledFor(log.DEBUG):
             self._logger.debug("Handler rules :")
             for rule in handlers:
@@ -370,13 +1513,270 @@ class AppServer(object):
 
         return handlers
 
+    def _setup_dispatch_rules(self, services):
+        """ Builds the rules used by the application to dispatch the requests.
+
+        They dispatch the requests the same way as the handlers list built by
+        :py:meth:`_setup_handlers` would do, but the rules of all the services are replaced
+        by a single :py:class:`ServicesRouter`, which selects the service rules to be tried
+        with a dictionary lookup.
+        """
+        self._services_router = ServicesRouter(self._app_url_base, services, loader=self._load_lazy_service)
+        return (
+            list(self.toplevel_handlers) + self._push_handlers() + self._data_store_handlers() +
+            [tornado.routing.Rule(tornado.routing.AnyMatches(), self._services_router)] +
+            list(self.fallback_handlers)
+        )
+
+    def _setup_executors(self):
+        """ Creates the thread pool shared by the services using the executor mode, and
+        the gates controlling the access of each of them.
+        """
+        if not self._executors_settings:
+            return
+        if ThreadPoolExecutor is None:
+            self._logger.error("concurrent.futures not installed => executor mode disabled for services %s",
+                               ', '.join(sorted(self._executors_settings)))
+            return
+
+        workers = self._executor_workers or sum(slots for slots, _ in self._executors_settings.values())
+        self._executor_pool = ThreadPoolExecutor(max_workers=workers)
+        self._logger.info("executor pool started with %d workers", workers)
+
+        for service_name, (slots, queue_size) in self._executors_settings.items():
+            self._service_executors[service_name] = ServiceExecutor(self._executor_pool, slots, queue_size)
+
+    def get_service_name(self, path):
+        """ Returns the name of the service owning a request path, or None if it is not
+        a service path.
+        """
+        return self._services_router.get_service_name(path)
+
+    def get_service_executor(self, path):
+        """ Returns the executor of the service owning a request path, or None if the
+        service does not use the executor mode.
+        """
+        return self._service_executors.get(self.get_service_name(path))
+
+    def _fork_workers(self, count):
+        """ Starts the worker processes, and supervises them until they are all terminated.
+
+        Workers dying because of an error are restarted. The supervisor process exits
+        when all the workers are terminated, and the method returns only in the workers.
+
+        This is a variant of `tornado.process.fork_processes`, which keeps track of
+        the workers so that termination requests can be forwarded to them.
+
+        :Parameters:
+            count : int
+                the number of worker processes
+
+        :returns: the id of the worker, in [0, count[
+        """
+        self._logger.info("starting %d worker processes", count)
+
+        def start_worker(worker_id):
+            pid = os.fork()
+            if pid == 0:
+                self._workers = {}
+                # handovers are managed by the supervisor process
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                self._logger.info("worker %d started (pid=%d)", worker_id, os.getpid())
+                return worker_id
+            self._workers[pid] = worker_id
+            return None
+
+        for i in range(count):
+            worker_id = start_worker(i)
+            if worker_id is not None:
+                return worker_id
+
+        signal.signal(signal.SIGTERM, self._sigterm_handler)
+        signal.signal(signal.SIGHUP, self._sighup_handler)
+        self._notify_predecessor()
+
+        restarts = 0
+        while self._workers:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            except KeyboardInterrupt:
+                # the workers got it too since they belong to the same process group
+                self._logger.info("SIGINT received.")
+                self._stopping = True
+                continue
+
+            if pid not in self._workers:
+                continue
+            worker_id = self._workers.pop(pid)
+            if os.WIFSIGNALED(status):
+                self._logger.warning("worker %d (pid=%d) killed by signal %d", worker_id, pid, os.WTERMSIG(status))
+            elif os.WEXITSTATUS(status) != 0:
+                self._logger.warning("worker %d (pid=%d) exited with status %d",
+                                     worker_id, pid, os.WEXITSTATUS(status))
+            else:
+                self._logger.info("worker %d (pid=%d) terminated", worker_id, pid)
+                continue
+
+            if self._stopping:
+                continue
+            restarts += 1
+            if restarts > self.MAX_WORKER_RESTARTS:
+                self._logger.critical("too many worker restarts => giving up")
+                self._stopping = True
+                for pid in self._workers:
+                    os.kill(pid, signal.SIGTERM)
+                continue
+            worker_id = start_worker(worker_id)
+            if worker_id is not None:
+                return worker_id
+
+        self._logger.info("all workers terminated")
+        sys.exit(0)
+
+    def get_route_pattern(self, handler):
+        """ Returns the pattern of the route matched by a request, or None if not found.
+
+        :Parameters:
+            handler : tornado.web.RequestHandler
+                the handler processing the request
+        """
+        candidates = self._route_patterns.get(handler.__class__)
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0][1]
+        # the handler class is used by several routes
+        path = handler.request.path
+        for regex, pattern in candidates:
+            if regex.match(path):
+                return pattern
+        return None
+
     def _sigterm_handler(self, _signum, _frame):
         """ Handles the SIGTERM signal to gently stop the server """
         self._logger.info("SIGTERM received.")
+        if self._workers:
+            self._stopping = True
+            self._logger.info("stopping worker processes.")
+            for pid in self._workers:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
         if self._ioloop:
+            self._ioloop.add_callback_from_signal(self._drain)
+
+    def _drain(self):
+        """ Stops the server once the requests in progress are completed.
+
+        New connections are no more accepted, push channels are closed, and the server loop
+        is stopped when no more request is in progress, or when the drain timeout is reached.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        self._logger.info("draining requests in progress (timeout=%.1fs)...", self._drain_timeout)
+        self._http_server.stop()
+        push.hub.close_all()
+
+        deadline = time.time() + self._drain_timeout
+
+        def check():
+            in_flight = self.metrics.total_in_flight()
+            if in_flight and time.time() < deadline:
+                self._ioloop.call_later(DRAIN_POLL_INTERVAL, check)
+                return
+            if in_flight:
+                self._logger.warning("drain timeout reached with %d requests still in progress", in_flight)
             self._logger.info("stopping server loop.")
             self._ioloop.stop()
 
+        check()
+
+    def _sighup_handler(self, _signum, _frame):
+        """ Handles the SIGHUP signal by starting a new server process, which takes over
+        the listening sockets and then stops this one.
+
+        The new process is started with the same command line. It inherits the listening
+        sockets, so that no connection is refused during the restart, and sends a SIGTERM
+        to this process once it is ready to serve the requests, which triggers the drain.
+        """
+        self._logger.info("SIGHUP received => handing over to a new server process")
+        if not self._sockets or self._stopping:
+            self._logger.error("*** no listening socket to hand over")
+            return
+
+        fds = ['%d:%d' % (sock.fileno(), sock.family) for sock in self._sockets]
+        env = dict(os.environ)
+        env[HANDOVER_FDS_ENV] = ','.join(fds)
+        env[HANDOVER_PID_ENV] = str(os.getpid())
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                # the sockets are made inheritable in the child only, so that the processes
+                # spawned later by this one do not inherit them
+                for sock in self._sockets:
+                    fd = sock.fileno()
+                    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) & ~fcntl.FD_CLOEXEC)
+                os.execve(sys.executable, [sys.executable] + sys.argv, env)
+            finally:
+                os._exit(1)     #pylint: disable=W0212
+        self._logger.info("new server process started (pid=%d)", pid)
+
+    def _get_listening_sockets(self):
+        """ Returns the listening sockets inherited from the process we are taking over, or
+        new ones if not started for a handover.
+        """
+        inherited = os.environ.pop(HANDOVER_FDS_ENV, None)
+        if not inherited:
+            return tornado.netutil.bind_sockets(self._port)
+
+        sockets = []
+        for item in inherited.split(','):
+            fd, family = (int(v) for v in item.split(':'))
+            sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+            # fromfd duplicates the descriptor
+            os.close(fd)
+            sock.setblocking(0)
+            fcntl.fcntl(sock.fileno(), fcntl.F_SETFD, fcntl.fcntl(sock.fileno(), fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+            sockets.append(sock)
+        self._logger.info("listening sockets inherited from process %s", os.environ.get(HANDOVER_PID_ENV))
+        return sockets
+
+    def _write_pid_file(self):
+        """ Writes the pid of this process in the pid file, if configured.
+
+        The file is replaced atomically, so that it is never seen empty by the tools
+        supervising the server.
+        """
+        if not self._pid_file:
+            return
+        tmp_path = self._pid_file + '.tmp'
+        try:
+            with open(tmp_path, 'w') as fp:
+                fp.write('%d\n' % os.getpid())
+            os.rename(tmp_path, self._pid_file)
+        except (IOError, OSError) as e:
+            self._logger.error("cannot write pid file %s (%s)", self._pid_file, e)
+
+    def _notify_predecessor(self):
+        """ Records this process as the server one and tells the process we are taking
+        over that it can stop, if any.
+        """
+        self._write_pid_file()
+        pid = os.environ.pop(HANDOVER_PID_ENV, None)
+        if pid:
+            self._logger.info("taking over from process %s", pid)
+            try:
+                os.kill(int(pid), signal.SIGTERM)
+            except OSError as e:
+                self._logger.warning("cannot stop process %s (%s)", pid, e)
+
     def get_services_home(self):
         return self._services_home
 
@@ -399,6 +1799,7 @@ class AppServer(object):
             raise RuntimeError('server already started')
 
         self._logger.info("server initializing")
+        start_time = time.time()
 
         # prepare the application settings dictionary
         # 1/ basic part
@@ -410,21 +1811,44 @@ class AppServer(object):
         if custom_settings:
             settings.update(custom_settings)
 
-        # setup request handlers by merging the one provided by the services
-        self._handlers = self._setup_handlers(self.services)
+        # discover the services (which runs their initialization if not deferred after the fork)
+        self._get_services()
+
+        if self._processes > 1 and self._debug:
+            raise RuntimeError('multi-process mode cannot be used in debug mode')
+        # the listening sockets are bound before forking, so that they are shared by all workers
+        self._sockets = self._get_listening_sockets()
+        self._logger.info("listening on port %d", self._port)
+        if self._processes > 1:
+            self._fork_workers(self._processes)
+            # from here we are in a worker process
+        self._run_deferred_inits()
 
         settings['log_function'] = self._log_request
-        self._application = tornado.web.Application(self._handlers, **settings) #pylint: disable=W0142
-        self._application.app_server = self
+        # started here so that the writer thread runs in the worker process
+        self._access_log = AccessLogWriter(self._logger, sampling=self._access_log_sampling)
+        self._access_log.start()
+        self._application = self._create_application(settings)
         self._http_server = tornado.httpserver.HTTPServer(self._application)
-        self._http_server.listen(self._port)
-        self._logger.info("listening on port %d", self._port)
+        self._http_server.add_sockets(self._sockets)
+        self._start_service_processes(custom_settings)
 
         signal.signal(signal.SIGTERM, self._sigterm_handler)
+        if self._processes == 1:
+            signal.signal(signal.SIGHUP, self._sighup_handler)
+            self._notify_predecessor()
 
         self._ioloop = tornado.ioloop.IOLoop.instance()
-
-        self._logger.info("web server started")
+        if self._loop_lag_threshold:
+            self.loop_monitor = LoopMonitor(self._logger, threshold=self._loop_lag_threshold)
+            self.loop_monitor.start()
+
+        self._logger.info("web server started in %.3fs", time.time() - start_time)
+        for status in self.get_services_status():
+            if status['loaded']:
+                self._logger.info("- %-20s loaded in %.1fms", status['name'], status['load_time'])
+            else:
+                self._logger.info("- %-20s deferred", status['name'])
         try:
             self._ioloop.start()
 
@@ -432,9 +1856,115 @@ class AppServer(object):
             self._logger.info("SIGINT received.")
             self._ioloop.stop()
 
+        if self.loop_monitor:
+            self.loop_monitor.stop()
+            self.loop_monitor = None
+        for process in self._service_processes.values():
+            process.stop()
+        if self._executor_pool:
+            self._executor_pool.shutdown(wait=False)
+            self._executor_pool = None
+
+        self._access_log.stop()
+        self._access_log = None
+        self.http_client.close()
+
         self._ioloop = None
         self._logger.info("terminated")
 
+    def _create_application(self, settings):
+        """ Creates the Tornado application dispatching the requests to the services."""
+        # setup request handlers by merging the one provided by the services
+        self._handlers = self._setup_handlers(self.services)
+        dispatch_rules = self._setup_dispatch_rules(self.services)
+        self._setup_executors()
+
+        self.profiles = profiling.create_store(settings)
+        if self.profiles:
+            self._logger.info("requests profiling enabled, records stored in %s", self.profiles.path)
+        transforms = [self.compression.transform] if self.compression else None
+        application = tornado.web.Application(
+            dispatch_rules, transforms=transforms, **settings
+        ) #pylint: disable=W0142
+        self._services_router.application = application
+        application.app_server = self
+        return application
+
+    def _start_service_processes(self, custom_settings):
+        """ Starts the child processes of the isolated services."""
+        for service_name, process in self._service_processes.items():
+            process.command = isolation.child_command(service_name)
+            process.options = {
+                'service': service_name,
+                'services_home': self._services_home,
+                'settings': custom_settings or {},
+                'log_level': self._logger.getEffectiveLevel(),
+                'server': {
+                    'url_base': self._app_url_base,
+                    'debug': self._debug,
+                    'json_backend': self._json_backend,
+                    'cache_max_size': self._cache_max_size,
+                    'init_timeout': self._init_timeout,
+                    'http_client_options': self._http_client_options,
+                    'data_store_path': self._data_store_path,
+                    'loop_lag_threshold': self._loop_lag_threshold
+                }
+            }
+            process.start()
+
+    def serve_isolated(self, service_name, sock, custom_settings, log_level):
+        """ Serves the requests of an isolated service, received from the server process.
+
+        This is the main loop of the child processes hosting isolated services (see
+        :py:mod:`pycstbox.webservices.isolation`). It returns when the server process
+        closes the connection.
+
+        :Parameters:
+            service_name : str
+                the name of the service
+            sock : socket.socket
+                the socket connected to the server process
+            custom_settings : dict
+                the application settings
+            log_level : int
+                the level of the server logger
+        """
+        self._logger.setLevel(log_level)
+        self._isolated_service = service_name
+        settings = {'debug': self._debug}
+        settings.update(custom_settings)
+        # the requests are logged by the server process
+        settings['log_function'] = lambda handler: None
+
+        self._get_services()
+        self._run_deferred_inits()
+        application = self._create_application(settings)
+
+        self._ioloop = tornado.ioloop.IOLoop.instance()
+        if self._loop_lag_threshold:
+            self.loop_monitor = LoopMonitor(self._logger, threshold=self._loop_lag_threshold)
+            self.loop_monitor.start()
+
+        def report():
+            return {'pid': os.getpid(), 'loop': self.loop_monitor.report() if self.loop_monitor else None}
+
+        isolation.serve(application, sock, self._logger, report).add_done_callback(lambda _: self._ioloop.stop())
+        self._logger.info("service '%s' served by process %d", service_name, os.getpid())
+        try:
+            self._ioloop.start()
+        except KeyboardInterrupt:
+            pass
+
+        if self.loop_monitor:
+            self.loop_monitor.stop()
+            self.loop_monitor = None
+
+        if self._executor_pool:
+            self._executor_pool.shutdown(wait=False)
+            self._executor_pool = None
+        self.http_client.close()
+        self._ioloop = None
+
     # custom request logging mechanism
     _muted_requests = []
 
@@ -453,12 +1983,27 @@ class AppServer(object):
         If disable_request_logging is not defined, the default logging strategy
         is applied.
 
+        Log records are emitted by a background thread (see
+        :py:mod:`pycstbox.webservices.accesslog`), and successful requests can be sampled
+        to reduce the log volume.
+
         IMPORTANT:
             Only successful requests are filtered by this mechanism, all other
             ones being logged
+
+        Whatever the request is logged or not, its processing time is recorded
+        in the server metrics.
         """
-        if handler.get_status() < 400:
-            key = handler.request.uri
+        request_time = handler.request.request_time()
+        route = getattr(handler, '_route', None) or self.get_route_pattern(handler) or UNKNOWN_ROUTE
+        status = handler.get_status()
+        self.metrics.observe(route, status, request_time)
+
+        access_log = self._access_log
+        emit = access_log.log if access_log else self._logger.log
+
+        if status < 400:
+            key = profiling.redact_uri(handler.request.uri)
             if key in self._muted_requests:
                 return
             try:
@@ -467,17 +2012,19 @@ class AppServer(object):
                 dont_log = False
             if dont_log:
                 self._muted_requests.append(key)
-                self._logger.warning("request '%s' is muted => last time we log it", key)
-            log_method = self._logger.info
+                emit(log.WARNING, "request '%s' is muted => last time we log it", key)
+            elif access_log and access_log.sampled_out(route, status):
+                return
+            level = log.INFO
 
-        elif handler.get_status() < 500:
-            log_method = self._logger.warning
+        elif status < 500:
+            level = log.WARNING
 
         else:
-            log_method = self._logger.error
+            level = log.ERROR
 
-        request_time = 1000.0 * handler.request.request_time()
-        log_method(
-            "%d %s %.2fms", handler.get_status(),
-            handler._request_summary(), request_time
-        )    # pylint: disable=W0212
+        request = handler.request
+        emit(
+            level, "%d %s %s (%s) %.2fms", status,
+            request.method, profiling.redact_uri(request.uri), request.remote_ip, 1000.0 * request_time
+        )
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Unit tests of the replies formats negotiation and of the columnar encoding."""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import array
+import struct
+import unittest
+
+from pycstbox.webservices import formats
+from pycstbox.webservices.formats import JSON, MSGPACK, COLUMNS
+
+
+def decode_columns(data):
+    """ Decodes a columnar reply, checking the alignment of its columns, and returns
+    the list of its (name, type, values) tuples.
+    """
+    magic, version, count = struct.unpack_from('<4sBxH', data, 0)
+    assert magic == formats.COLUMNS_MAGIC and version == formats.COLUMNS_VERSION
+    offset = struct.calcsize('<4sBxH')
+    descriptors = []
+    for _ in range(count):
+        type_code, length, name_length = struct.unpack_from('<2sIH', data, offset)
+        offset += struct.calcsize('<2sIH')
+        descriptors.append((data[offset:offset + name_length].decode('utf-8'), type_code, length))
+        offset += name_length
+
+    columns = []
+    for name, type_code, length in descriptors:
+        padding = -offset % 8
+        assert data[offset:offset + padding] == '\0' * padding
+        offset += padding
+        size = int(type_code[1])
+        fmt = '<%d%s' % (length, {'f4': 'f', 'f8': 'd', 'i1': 'b', 'i2': 'h', 'i4': 'i', 'i8': 'q',
+                                  'u1': 'B', 'u2': 'H', 'u4': 'I', 'u8': 'Q'}[type_code])
+        columns.append((name, type_code, list(struct.unpack_from(fmt, data, offset))))
+        offset += length * size
+    assert offset == len(data)
+    return columns
+
+
+class ColumnsEncodingTestCase(unittest.TestCase):
+    def test_arrays(self):
+        data = formats.encode_columns([
+            ('t', array.array('d', [1.5, 2.5, 3.5])),
+            ('v', array.array('i', [1, -2, 3])),
+            ('n', array.array('B', [7, 8]))
+        ])
+        self.assertEqual(decode_columns(data), [
+            ('t', 'f8', [1.5, 2.5, 3.5]),
+            ('v', 'i%d' % array.array('i').itemsize, [1, -2, 3]),
+            ('n', 'u1', [7, 8])
+        ])
+
+    def test_lists_are_encoded_as_doubles(self):
+        data = formats.encode_columns([('x', [0.25, 1, -3])])
+        self.assertEqual(decode_columns(data), [('x', 'f8', [0.25, 1., -3.])])
+
+    def test_padding(self):
+        # odd sized columns and names force padding before each next column
+        data = formats.encode_columns([
+            ('a', array.array('B', [1, 2, 3])),
+            (u'températures', array.array('h', [-1])),
+            ('b', array.array('d', [4.]))
+        ])
+        self.assertEqual(decode_columns(data), [
+            ('a', 'u1', [1, 2, 3]),
+            (u'températures', 'i2', [-1]),
+            ('b', 'f8', [4.])
+        ])
+
+    def test_empty(self):
+        self.assertEqual(decode_columns(formats.encode_columns([])), [])
+        self.assertEqual(decode_columns(formats.encode_columns([('e', [])])), [('e', 'f8', [])])
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            formats.encode_columns([('c', array.array('c', 'abc'))])
+
+    def test_as_dict(self):
+        columns = [('t', array.array('d', [1.5])), ('v', [2])]
+        self.assertEqual(formats.columns_as_dict(columns).items(), [('t', [1.5]), ('v', [2])])
+
+
+class NegotiationTestCase(unittest.TestCase):
+    DOCUMENT = (JSON, MSGPACK)
+    ALL = (JSON, MSGPACK, COLUMNS)
+
+    def test_default(self):
+        self.assertEqual(formats.negotiate('', self.ALL), JSON)
+        self.assertEqual(formats.negotiate('*/*', self.ALL), JSON)
+        self.assertEqual(formats.negotiate('text/html', self.ALL), JSON)
+
+    def test_explicit(self):
+        self.assertEqual(formats.negotiate('application/msgpack', self.DOCUMENT), MSGPACK)
+        self.assertEqual(formats.negotiate(COLUMNS, self.ALL), COLUMNS)
+        # not offered
+        self.assertEqual(formats.negotiate(COLUMNS, self.DOCUMENT), JSON)
+
+    def test_alias(self):
+        self.assertEqual(formats.negotiate('application/x-msgpack', self.DOCUMENT), MSGPACK)
+
+    def test_quality(self):
+        self.assertEqual(formats.negotiate('application/json;q=0.5, application/msgpack', self.DOCUMENT), MSGPACK)
+        self.assertEqual(formats.negotiate('application/json, application/msgpack;q=0.5', self.DOCUMENT), JSON)
+        self.assertEqual(formats.negotiate('application/msgpack;q=0, */*', self.DOCUMENT), JSON)
+        # invalid qualities exclude the type
+        self.assertEqual(formats.negotiate('application/msgpack;q=high, */*;q=0.1', self.DOCUMENT), JSON)
+
+    def test_wildcards(self):
+        # explicitly requested types win over wildcard matches with the same quality
+        self.assertEqual(formats.negotiate('application/*, application/msgpack', self.DOCUMENT), MSGPACK)
+        self.assertEqual(formats.negotiate('application/*;q=0.9, ' + COLUMNS, self.ALL), COLUMNS)
+        # the most specific range gives the quality of a type
+        self.assertEqual(formats.negotiate('application/*;q=0.1, application/msgpack;q=0.2', self.DOCUMENT), MSGPACK)
+        self.assertEqual(formats.negotiate('*/*;q=0.5, application/json;q=0', self.DOCUMENT), MSGPACK)
+
+    def test_nothing_acceptable(self):
+        self.assertEqual(formats.negotiate('application/json;q=0, application/msgpack;q=0', self.DOCUMENT), JSON)
+
+
+if __name__ == '__main__':
+    unittest.main()
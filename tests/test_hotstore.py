@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Unit tests of the shared memory store of the variables latest values."""
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pycstbox.webservices import hotstore
+from pycstbox.webservices.hotstore import HotStore, HotStoreError
+
+
+class ScriptedSeq(object):
+    """ Replaces the sequence counters struct of the module, returning scripted values
+    for the first reads, as if a writer was updating the slot meanwhile.
+    """
+    def __init__(self, seq_struct, values):
+        self._struct = seq_struct
+        self.values = list(values)
+        self.reads = 0
+
+    def unpack_from(self, buf, offset=0):
+        self.reads += 1
+        if self.values:
+            return (self.values.pop(0),)
+        return self._struct.unpack_from(buf, offset)
+
+    def pack_into(self, buf, offset, value):
+        self._struct.pack_into(buf, offset, value)
+
+
+class StoreTestCase(unittest.TestCase):
+    """ Base class of the test cases, providing a new store for each test."""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'store')
+        self.store = HotStore(self.path, capacity=4, create=True)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp_dir)
+
+
+class HotStoreTestCase(StoreTestCase):
+    def test_put_get(self):
+        self.store.put(u'temp', 21.5, 1000.)
+        self.assertEqual(self.store.get(u'temp'), (21.5, 1000.))
+        self.store.put(u'temp', 22., 1001.)
+        self.assertEqual(self.store.get(u'temp'), (22., 1001.))
+        self.assertIsNone(self.store.get(u'unknown'))
+
+    def test_default_timestamp(self):
+        self.store.put(u'temp', 1.)
+        self.assertGreater(self.store.get(u'temp')[1], 0)
+
+    def test_items(self):
+        self.store.put(u'a', 1., 10.)
+        self.store.put(u'b', 2., 20.)
+        self.assertEqual(sorted(self.store.items()), [(u'a', 1., 10.), (u'b', 2., 20.)])
+        self.assertEqual(self.store.items([u'b', u'unknown']), [(u'b', 2., 20.)])
+
+    def test_shared_between_instances(self):
+        reader = HotStore(self.path)
+        try:
+            self.store.put(u'a', 1., 10.)
+            self.assertEqual(reader.get(u'a'), (1., 10.))
+            # slots allocated after the reader has built its index
+            self.store.put(u'b', 2., 20.)
+            self.assertEqual(sorted(reader.items()), [(u'a', 1., 10.), (u'b', 2., 20.)])
+            reader.put(u'a', 3., 30.)
+            self.assertEqual(self.store.get(u'a'), (3., 30.))
+        finally:
+            reader.close()
+
+    def test_limits(self):
+        with self.assertRaises(ValueError):
+            self.store.put(u'x' * (hotstore.MAX_NAME_LENGTH + 1), 1.)
+        for i in range(self.store.capacity):
+            self.store.put(u'v%d' % i, i)
+        with self.assertRaises(HotStoreError):
+            self.store.put(u'one_more', 1.)
+
+    def test_invalid_file(self):
+        path = os.path.join(self.tmp_dir, 'invalid')
+        with open(path, 'wb') as fp:
+            fp.write('not a store' * 10)
+        with self.assertRaises(HotStoreError):
+            HotStore(path)
+
+
+class SeqlockTestCase(StoreTestCase):
+    """ Reads of slots being written at the same time."""
+    def _script(self, values):
+        scripted = ScriptedSeq(hotstore._SEQ, values)     #pylint: disable=W0212
+        hotstore._SEQ = scripted                          #pylint: disable=W0212
+        self.addCleanup(setattr, hotstore, '_SEQ', scripted._struct)
+        return scripted
+
+    def test_retry_while_odd(self):
+        self.store.put(u'temp', 21.5, 1000.)
+        seq = self._script([1, 1])
+        self.assertEqual(self.store.get(u'temp'), (21.5, 1000.))
+        # two reads with an update in progress, then the consistent before and after reads
+        self.assertEqual(seq.reads, 4)
+
+    def test_retry_when_changed(self):
+        self.store.put(u'temp', 21.5, 1000.)
+        # the slot is updated between the before and after reads
+        seq = self._script([2, 4])
+        self.assertEqual(self.store.get(u'temp'), (21.5, 1000.))
+        self.assertEqual(seq.reads, 4)
+
+    def test_locked_slot(self):
+        self.store.put(u'temp', 21.5, 1000.)
+        self._script([1] * hotstore._MAX_READ_ATTEMPTS)     #pylint: disable=W0212
+        self.assertIsNone(self.store.get(u'temp'))
+
+    def test_bulk_read_fallback(self):
+        self.store.put(u'a', 1., 10.)
+        self.store.put(u'b', 2., 20.)
+        # writer in progress on the slot of b : its counter is odd
+        offset = self.store._index[u'b']        #pylint: disable=W0212
+        hotstore._SEQ.pack_into(self.store._mm, offset, 3)        #pylint: disable=W0212
+        self.assertEqual(self.store.items(), [(u'a', 1., 10.)])
+        hotstore._SEQ.pack_into(self.store._mm, offset, 4)        #pylint: disable=W0212
+        self.assertEqual(sorted(self.store.items()), [(u'a', 1., 10.), (u'b', 2., 20.)])
+
+    def test_never_written_slot(self):
+        self.store.put(u'a', 1., 10.)
+        # slot allocated by a writer which has not written its value yet
+        self.store._allocate(u'b')      #pylint: disable=W0212
+        self.assertEqual(self.store.items(), [(u'a', 1., 10.)])
+        self.assertIsNone(self.store.get(u'b'))
+
+
+if __name__ == '__main__':
+    unittest.main()